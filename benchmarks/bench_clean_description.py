@@ -0,0 +1,99 @@
+"""
+Micro-benchmark for utils.clean_description.
+
+Checks that the compiled, literal-guarded rule engine gives exactly the same output as the original
+loop (every PROMO_PHRASES pattern applied with re.sub and .strip() in order) on a generated fixture
+corpus, then times both. The corpus is seeded, so every run uses the same descriptions.
+
+    python benchmarks/bench_clean_description.py [--size N] [--seed S]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import PROMO_PHRASES, clean_description # noqa: E402
+
+def reference_clean_description(description: str, movie_title_for_ref: str = "") -> str:
+    """The cleanup loop as it was before the rule engine, kept verbatim for comparison."""
+    for phrase in PROMO_PHRASES:
+        description = re.sub(phrase, '', description, flags=re.IGNORECASE | re.DOTALL).strip()
+
+    description = re.sub(r'^[^\w\s\u0600-\u06FF]+', '', description).strip()
+    description = re.sub(r'[^\w\s\u0600-\u06FF]+$', '', description).strip()
+
+    if movie_title_for_ref and description.lower().startswith(movie_title_for_ref.lower()):
+        description = description[len(movie_title_for_ref):].strip()
+        description = re.sub(r'^[^\w\s\u0600-\u06FF]+', '', description).strip()
+
+    description = re.sub(r'\s{2,}', ' ', description).strip()
+
+    if len(description) > 500:
+        description = description[:497] + "..."
+    return description
+
+# Fixture vocabulary: plain story words, promotional phrases the rules target, and punctuation/whitespace
+STORY_WORDS = ["تدور", "القصة", "حول", "شاب", "يحاول", "إنقاذ", "عائلته", "في", "مدينة", "مظلمة",
+               "the", "hero", "returns", "2023", "HD", "Avengers", "بطل", "رحلة", "صديق"]
+PROMO_SNIPPETS = ["مشاهدة وتحميل فيلم", "مشاهدة مسلسل", "تحميل مباشر", "حصريا", "اون لاين", "بجودة HD",
+                  "بجودة 1080p", "كامل ومترجم", "مترجم للعربية", "مدبلج", "شاهد مجانا", "الموسم الثاني",
+                  "الموسم 3", "ايجي بست", "وي سيما", "موقع ماي سيما", "قصة فيلم جديد تدور احداث حول",
+                  "تدور احداث الفيلم حول", "ملخص القصة", "فيلم جديد", "انمي حصري", "أفلام2024", "اونلاين", "افلام"]
+NOISE = ["-", ".", "!", "|", "»", ":", "  ", "\n", "\t", " - ", "..."]
+TITLES = ["", "Avengers", "الرحلة", "فيلم الرحلة"]
+
+def make_corpus(size: int, seed: int) -> list:
+    """Returns (description, title) pairs at several promo densities, with and without outer whitespace/noise."""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(size):
+        promo_density = (0.03, 0.2, 0.5)[i % 3]
+        parts = []
+        for _ in range(rng.randint(0, 60)):
+            roll = rng.random()
+            if roll < promo_density:
+                parts.append(rng.choice(PROMO_SNIPPETS))
+            elif roll < promo_density + 0.1:
+                parts.append(rng.choice(NOISE))
+            else:
+                parts.append(rng.choice(STORY_WORDS))
+        description = " ".join(parts)
+        if rng.random() < 0.3: # Unstripped input, e.g. raw text from a page
+            description = rng.choice(["", " ", "  ", "\n", " - "]) + description + rng.choice(["", " ", "\n", " . "])
+        corpus.append((description, rng.choice(TITLES)))
+    return corpus
+
+def time_function(func, corpus: list, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for description, title in corpus:
+            func(description, title)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=9000, help="number of fixture descriptions")
+    parser.add_argument("--seed", type=int, default=6, help="corpus seed")
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.size, args.seed)
+    mismatches = [(description, title) for description, title in corpus
+                  if clean_description(description, title) != reference_clean_description(description, title)]
+    for description, title in mismatches[:5]:
+        print(f"MISMATCH {description!r} (title {title!r}): "
+              f"{clean_description(description, title)!r} != {reference_clean_description(description, title)!r}")
+    print(f"{len(corpus)} descriptions, {len(mismatches)} mismatches")
+
+    reference_seconds = time_function(reference_clean_description, corpus)
+    engine_seconds = time_function(clean_description, corpus)
+    print(f"reference loop: {reference_seconds:.3f}s, rule engine: {engine_seconds:.3f}s "
+          f"({reference_seconds / engine_seconds:.1f}x)")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
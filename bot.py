@@ -3,17 +3,18 @@ import subprocess
 import sys
 import os # Import os for environment variables
 import re
-import sqlite3
 import threading
 import schedule
 import time
 import asyncio
+from datetime import datetime
 from bs4 import BeautifulSoup
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler, MessageHandler, filters
 from flask import Flask
 from urllib.parse import urlparse, urlunparse # استيراد الوحدات اللازمة
 from playwright.async_api import async_playwright # استيراد مكتبة Playwright
+from broadcast import drain_outbox # إرسال الإشعارات الجماعية ضمن حدود معدل Telegram
 
 # --- Logging Setup ---
 import logging
@@ -83,40 +84,12 @@ def run_flask_app():
 threading.Thread(target=run_flask_app, daemon=True).start()
 
 # --- تهيئة قاعدة البيانات ---
-def init_db():
-    conn = sqlite3.connect('movies.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS movies
-                (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 title TEXT NOT NULL,
-                 url TEXT NOT NULL UNIQUE,
-                 source TEXT NOT NULL,
-                 image_url TEXT,
-                 last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    # Add image_url column if it doesn't exist
-    try:
-        c.execute("ALTER TABLE movies ADD COLUMN image_url TEXT")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" not in str(e):
-            logger.error(f"Error altering table: {e}") # استخدام logger
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                (user_id INTEGER PRIMARY KEY,
-                 username TEXT,
-                 first_name TEXT,
-                 last_name TEXT,
-                 join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    conn.commit()
-    conn.close()
-
-# --- إضافة مستخدم جديد ---
-def add_user(user_id, username, first_name, last_name):
-    conn = sqlite3.connect('movies.db')
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO users (user_id, username, first_name, last_name) VALUES (?, ?, ?, ?)",
-              (user_id, username, first_name, last_name))
-    conn.commit()
-    conn.close()
+# المخطط (schema) وترحيلاته معرّفة في db_manager فقط، وهو مشترك بين جميع نقاط التشغيل
+from db_manager import init_db, PREFERENCE_COLUMNS, preference_column_for_category
+from scrapers import close_scraper_resources
+from utils import deduce_category
+import config
+import db_async # كل استعلامات قاعدة البيانات داخل الدوال غير المتزامنة تمر عبره حتى لا تُجمّد حلقة الأحداث
 
 # --- تنظيف العناوين ---
 def clean_title(title):
@@ -577,6 +550,8 @@ async def scrape_movies_async(): # تحويل الدالة لتصبح async
     new_movies = []
     total_added_count = 0 
     browser = None # تهيئة browser خارج try لتأكيد إغلاقه في finally
+    round_started_at = datetime.now()
+    results = []
     try:
         # تعيين مسار المتصفحات لـ Playwright
         # هذا يخبر Playwright بالبحث عن المتصفحات في دليل ذاكرة التخزين المؤقت لـ Replit
@@ -589,9 +564,6 @@ async def scrape_movies_async(): # تحويل الدالة لتصبح async
                 args=["--no-sandbox", "--disable-gpu", "--disable-dev-shm-usage"]
             ) 
 
-            conn = sqlite3.connect('movies.db')
-            c = conn.cursor()
-
             # إنشاء مهام كشط لكل موقع بالتوازي
             tasks = []
             for scraper in SCRAPERS:
@@ -601,37 +573,37 @@ async def scrape_movies_async(): # تحويل الدالة لتصبح async
             # تنفيذ جميع مهام الكشط بالتوازي
             results = await asyncio.gather(*tasks)
 
+            # الأفلام الموجودة مسبقاً لا تُعدّل هنا؛ تُضاف الجديدة فقط عبر مسار الكتابة الموحد في db_manager
+            stored_urls = await db_async.get_stored_movie_urls([movie["url"] for movies in results for movie in movies])
+            movies_to_add = []
             for scraper_idx, movies in enumerate(results):
                 scraper = SCRAPERS[scraper_idx] # الحصول على معلومات السكرابر الأصلية
                 added_count = 0
                 for movie in movies:
                     try:
+                        if movie["url"] in stored_urls:
+                            continue
+                        stored_urls.add(movie["url"]) # نفس الرابط من موقعين يُضاف مرة واحدة
                         # تنظيف العنوان قبل إدخاله في قاعدة البيانات
                         clean_title_text = clean_title(movie["title"])
-                        # التحقق مما إذا كان الفيلم موجودًا بالفعل باستخدام الرابط النظيف (clean URL)
-                        c.execute("SELECT id FROM movies WHERE url = ?", (movie["url"],))
-                        if c.fetchone() is None:
-                            c.execute("INSERT INTO movies (title, url, source, image_url) VALUES (?, ?, ?, ?)",
-                                      (clean_title_text, movie["url"], scraper["name"], movie.get("image_url")))
-                            new_movies.append({
-                                "title": clean_title_text,
-                                "url": movie["url"],
-                                "source": scraper["name"],
-                                "image_url": movie.get("image_url")
-                            })
-                            added_count += 1
-                    except sqlite3.IntegrityError:
-                        # هذا يحدث إذا كان هناك فيلم بنفس الـ URL موجود بالفعل (UNIQUE constraint)
-                        pass
+                        movies_to_add.append({
+                            "title": clean_title_text,
+                            "url": movie["url"],
+                            "source": scraper["name"],
+                            "category": deduce_category(movie["title"], movie["url"]), # من العنوان الأصلي قبل حذف كلمة "مسلسل"/"انمي"
+                            "image_url": movie.get("image_url")
+                        })
+                        added_count += 1
                     except Exception as e:
                         logger.error(f"  ❌ خطأ في إضافة فيلم من {scraper['name']} ({movie.get('title', 'N/A')}): {e}") # استخدام logger
                 
                 if added_count > 0:
                     logger.info(f"  ✅ تمت إضافة {added_count} أفلام جديدة من {scraper['name']}") # استخدام logger
                 total_added_count += added_count
-                conn.commit()
 
-            conn.close()
+            # معاملة واحدة لكل الجولة؛ صفحات التفاصيل لم تُزر هنا، فيبقى details_fetched_at فارغاً ليجلبها الكاشط لاحقاً
+            new_urls = await db_async.upsert_movies_batch(movies_to_add, details_fetched=False, announce=True)
+            new_movies = [movie for movie in movies_to_add if movie["url"] in new_urls]
 
     except Exception as e:
         logger.critical(f"⚠️ خطأ أثناء جمع الأفلام: {e}") # استخدام logger
@@ -640,60 +612,113 @@ async def scrape_movies_async(): # تحويل الدالة لتصبح async
             await browser.close() # تأكد من إغلاق المتصفح
             logger.info("متصفح Playwright تم إغلاقه.") # استخدام logger
             
+    # تسجيل توقيت الجولة وأعدادها ليعرضها /alive
+    await db_async.record_scrape_round(
+        "bot", round_started_at, datetime.now(), sum(len(movies) for movies in results), len(new_movies),
+        sites_ok=sum(1 for movies in results if movies),
+        sites_failed=len(SCRAPERS) - sum(1 for movies in results if movies),
+    )
     logger.info(f"✅ تمت إضافة {total_added_count} فيلم جديد في هذه الجولة.") # استخدام logger
     return new_movies
 
+# --- تجهيز رسائل الإشعارات ---
+TELEGRAM_MESSAGE_LIMIT = 4096 # أقصى طول لرسالة Telegram واحدة
+
+# كل عمود في PREFERENCE_COLUMNS يقابله بت في قناع تفضيلات المستخدم؛ قاعدة الفئة -> العمود معرّفة في db_manager فقط
+def preference_mask(*preferences):
+    """يحوّل أعلام التفضيلات (بترتيب PREFERENCE_COLUMNS) إلى قناع بتات، فلا يوجد إلا 8 ملخصات مختلفة على الأكثر."""
+    return sum(1 << bit for bit, enabled in enumerate(preferences) if enabled)
+
+def category_preference_bit(category):
+    """بت الفئة في قناع التفضيلات (العناصر بلا فئة تُعامل كأفلام، كما في preference_column_for_category)."""
+    return 1 << PREFERENCE_COLUMNS.index(preference_column_for_category(category))
+
+def split_message(lines):
+    """يجمع الأسطر في رسائل لا تتجاوز TELEGRAM_MESSAGE_LIMIT، ولا يقسم سطراً (حتى لا ينكسر وسم HTML)."""
+    messages = []
+    current = ""
+    for line in lines:
+        if current and len(current) + len(line) > TELEGRAM_MESSAGE_LIMIT:
+            messages.append(current)
+            current = ""
+        current += line
+    if current:
+        messages.append(current)
+    return messages
+
+def render_digest(movies, header):
+    """
+    يبني ملخص الأفلام (أول 5 من كل مصدر) مقسّماً مسبقاً إلى رسائل ضمن حد Telegram.
+    كل عنصر عمل واحد (انظر db_manager.group_movies_by_work)، وتُعرض روابط نسخه على المواقع الأخرى بجانبه.
+    """
+    # تجميع الأفلام حسب المصدر
+    movies_by_source = {}
+    for movie in movies:
+        if movie['source'] not in movies_by_source:
+            movies_by_source[movie['source']] = []
+        movies_by_source[movie['source']].append(movie)
+
+    lines = [header]
+    for source, source_movies in movies_by_source.items():
+        lines.append(f"<b>{source}:</b>\n")
+        for movie in source_movies[:5]:
+            # دمج رابط الصورة كنص بجانب رابط الفيلم
+            image_link_text = f" (<a href='{movie['image_url']}'>صورة</a>)" if movie.get('image_url') else ""
+            other_sources = [(source_name, url) for source_name, url in movie.get('sources', []) if url != movie['url']]
+            sources_text = (" | " + " · ".join(f"<a href='{url}'>{source_name}</a>" for source_name, url in other_sources)) if other_sources else ""
+            lines.append(f"• <a href='{movie['url']}'>{movie['title']}</a>{image_link_text}{sources_text}\n")
+        lines.append("\n")
+    return split_message(lines)
+
 # --- إرسال الأفلام الجديدة للمستخدمين ---
 async def send_new_movies(context: ContextTypes.DEFAULT_TYPE):
-    # استدعاء الدالة غير المتزامنة لكشط الأفلام
+    # استدعاء الدالة غير المتزامنة لكشط الأفلام؛ الأفلام الجديدة تُحفظ معلَّمة announce_pending في نفس المعاملة
     new_movies = await scrape_movies_async() 
     if not new_movies:
         logger.info("لا توجد أفلام جديدة للإرسال.") # استخدام logger
+
+    # تُنقل كل الإعلانات المعلّقة إلى صندوق الصادر، بما فيها ما تركته جولة قطعتها إعادة تشغيل
+    await enqueue_pending_announcements()
+
+    # يُرسل كل ما ينتظر في صندوق الصادر، بما فيه بقية بث قطعته إعادة تشغيل سابقة
+    await drain_outbox(
+        context.bot,
+        parse_mode='HTML',
+        disable_web_page_preview=True # Keep this true to prevent large URL previews
+    )
+
+async def enqueue_pending_announcements():
+    """
+    يحوّل الأفلام المعلَّمة announce_pending إلى ملخصات في صندوق الصادر (outbox)، ويُزال التعليم في نفس
+    المعاملة التي تُكتب فيها الرسائل، فلا يضيع البث إذا أُعيد تشغيل البوت بين الحفظ والإرسال.
+    """
+    new_movies, announced_urls = await db_async.get_pending_announcements()
+    if not announced_urls:
         return
 
-    conn = sqlite3.connect('movies.db')
-    c = conn.cursor()
-    c.execute("SELECT user_id FROM users")
-    users = c.fetchall()
-    conn.close()
+    # توجيه حسب الفئة: لا يُحمَّل إلا من يستقبل فئة واحدة على الأقل من فئات هذه الجولة
+    round_categories = {movie.get('category') for movie in new_movies}
+    recipients = await db_async.get_all_users_with_preferences(round_categories) if new_movies else []
 
-    # تجميع الأفلام حسب المصدر
-    movies_by_source = {}
-    for movie in new_movies:
-        if movie['source'] not in movies_by_source:
-            movies_by_source[movie['source']] = []
-        movies_by_source[movie['source']].append(movie)
+    # تجميع المستخدمين حسب قناع التفضيلات، فيُبنى كل ملخص مرة واحدة لكل مجموعة وليس لكل مستخدم
+    users_by_mask = {}
+    for user_id, *preferences in recipients:
+        users_by_mask.setdefault(preference_mask(*preferences), []).append(user_id)
 
-    for user_id, in users:
-        try:
-            message_parts = []
-            message_parts.append("🎬 <b>أفلام جديدة متاحة:</b>\n\n")
-            
-            for source, movies in movies_by_source.items():
-                message_parts.append(f"<b>{source}:</b>\n")
-                # عرض أول 5 أفلام من كل مصدر
-                for movie in movies[:5]: 
-                    # دمج رابط الصورة كنص بجانب رابط الفيلم
-                    image_link_text = f" (<a href='{movie['image_url']}'>صورة</a>)" if movie.get('image_url') else ""
-                    message_parts.append(f"• <a href='{movie['url']}'>{movie['title']}</a>{image_link_text}\n")
-                message_parts.append("\n")
-            
-            final_message = "".join(message_parts)
-
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=final_message,
-                parse_mode='HTML',
-                disable_web_page_preview=True # Keep this true to prevent large URL previews
-            )
-            await asyncio.sleep(0.3) # تأخير بسيط لتجنب حدود معدل Telegram API
-        except Exception as e:
-            logger.error(f"❌ خطأ في إرسال الأفلام للمستخدم {user_id}: {e}") # استخدام logger
+    digests = []
+    for mask, user_ids in users_by_mask.items():
+        group_movies = [movie for movie in new_movies if category_preference_bit(movie.get('category')) & mask]
+        if not group_movies:
+            continue # لا رسالة لمن لا تهمه فئات هذه الجولة
+        digests.append((render_digest(group_movies, "🎬 <b>أفلام جديدة متاحة:</b>\n\n"), user_ids))
+
+    queued_count = await db_async.enqueue_notifications(digests, announced_urls)
+    logger.info(f"📝 تم تجهيز ملخصات {len(users_by_mask)} مجموعة تفضيلات لـ {queued_count} مستخدم (الفئات: {', '.join(sorted(map(str, round_categories)))}).")
 
 # --- أمر بدء البوت ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    add_user(user.id, user.username, user.first_name, user.last_name)
+    await db_async.add_user(user.id, user.username, user.first_name, user.last_name) # يعيد تفعيل المستخدم إن كان قد حظر البوت سابقاً
 
     welcome_msg = (
         f"🎉 مرحباً {user.first_name}!\n"
@@ -714,20 +739,30 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # --- أمر فحص حالة البوت ---
 async def alive(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    conn = sqlite3.connect('movies.db')
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM movies")
-    movies_count = c.fetchone()[0]
-    c.execute("SELECT COUNT(*) FROM users")
-    users_count = c.fetchone()[0]
-    conn.close()
-    
+    stats = await db_async.get_bot_stats() # عدادات جاهزة وآخر جولة، بدون COUNT(*) على الجداول
+    last_round = stats["last_round"]
+
+    if last_round:
+        minutes_ago = int((datetime.now() - last_round["finished_at"]).total_seconds() // 60)
+        freshness_lines = (
+            f"⏱️ آخر تحديث: {last_round['finished_at']:%Y-%m-%d %H:%M} (منذ {minutes_ago} دقيقة)\n"
+            f"⚙️ مدة الجولة: {last_round['duration_seconds']:.0f} ثانية | عناصر: {last_round['items_processed']} | جديد: {last_round['new_movies']}\n"
+            f"🌐 مواقع تعمل: {last_round['sites_ok']} | متعثرة: {last_round['sites_failed']}\n"
+        )
+    else:
+        freshness_lines = "⏱️ لم تكتمل أي جولة تحديث بعد\n"
+
+    scrape_jobs = schedule.get_jobs("scrape") # موعد الجولة القادمة كما يعرفه المُجدول نفسه
+    if scrape_jobs and scrape_jobs[0].next_run:
+        freshness_lines += f"🔄 التحديث التالي: {scrape_jobs[0].next_run:%H:%M}"
+    else:
+        freshness_lines += "🔄 التحديث التالي: بعد انتهاء الجولة الأولى"
+
     status_msg = (
         "✅ أنا شغال وقوي!\n\n"
-        f"🎥 عدد الأفلام في قاعدة البيانات: <b>{movies_count}</b>\n"
-        f"👥 عدد المستخدمين: <b>{users_count}</b>\n"
-        "⏱️ آخر تحديث: منذ قليل\n"
-        "🔄 التحديث التالي: خلال ساعة"
+        f"🎥 عدد الأفلام في قاعدة البيانات: <b>{stats['movies']}</b>\n"
+        f"👥 عدد المستخدمين: <b>{stats['users']}</b>\n"
+        f"{freshness_lines}"
     )
     
     await update.message.reply_text(
@@ -745,31 +780,18 @@ async def manual_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⚠️ لم يتم العثور على أفلام جديدة في هذه الجولة.")
         return
     
-    message_parts = []
-    message_parts.append("🎉 <b>تم العثور على أفلام جديدة:</b>\n\n")
-
-    movies_by_source = {}
-    for movie in new_movies:
-        if movie['source'] not in movies_by_source:
-            movies_by_source[movie['source']] = []
-        movies_by_source[movie['source']].append(movie)
-
-    for source, movies in movies_by_source.items():
-        message_parts.append(f"<b>{source}:</b>\n")
-        for movie in movies[:5]: # عرض أول 5 أفلام جديدة من كل مصدر
-            image_link_text = f" (<a href='{movie['image_url']}'>صورة</a>)" if movie.get('image_url') else ""
-            message_parts.append(f"• <a href='{movie['url']}'>{movie['title']}</a>{image_link_text}\n")
-        message_parts.append("\n")
-    
-    final_message = "".join(message_parts)
-
-    await update.message.reply_text(
-        final_message,
-        parse_mode='HTML',
-        disable_web_page_preview=True
-    )
+    works = await db_async.group_movies_by_work(new_movies) # نفس الإصدار من عدة مواقع يظهر مرة واحدة مع روابط نسخه
+    for message in render_digest(works, "🎉 <b>تم العثور على أفلام جديدة:</b>\n\n"):
+        await update.message.reply_text(
+            message,
+            parse_mode='HTML',
+            disable_web_page_preview=True
+        )
 
 # --- جدولة المهام ---
+scheduler_stop = threading.Event() # يُضبط عند إيقاف البوت فتنتهي حلقة المُجدول
+scheduler_thread = None
+
 def schedule_job(application):
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
@@ -781,27 +803,48 @@ def schedule_job(application):
         except Exception as e:
             logger.error(f"خطأ في المهمة المجدولة: {e}") # استخدام logger
 
-    schedule.every(1).hours.do(run_async_task_wrapper)
+    def run_cleanup_wrapper():
+        try:
+            # حذف الأفلام الأقدم من MOVIE_RETENTION_DAYS على دفعات قصيرة
+            loop.run_until_complete(db_async.cleanup_old_movies())
+        except Exception as e:
+            logger.error(f"خطأ في تنظيف قاعدة البيانات: {e}") # استخدام logger
+
+    schedule.every(config.SCRAPE_INTERVAL_HOURS).hours.do(run_async_task_wrapper).tag("scrape")
+    schedule.every().day.at(config.DB_CLEANUP_TIME).do(run_cleanup_wrapper)
     
     logger.info("بدء عملية جمع الأفلام الأولية...") # استخدام logger
     run_async_task_wrapper()  # Initial run
 
-    while True:
+    while not scheduler_stop.is_set():
         schedule.run_pending()
-        time.sleep(30)
+        scheduler_stop.wait(30)
+    loop.close()
+
+async def shutdown_resources(application):
+    """يوقف المُجدول ثم يغلق ما يبقى مفتوحاً بين الجولات (جلسة HTTP، خيوط الكاش والتحليل، اتصال قاعدة البيانات)"""
+    scheduler_stop.set()
+    if scheduler_thread is not None:
+        await asyncio.to_thread(scheduler_thread.join, config.SCHEDULER_STOP_TIMEOUT_SECONDS)
+        if scheduler_thread.is_alive():
+            logger.warning("⚠️ جولة التحديث الحالية لم تنتهِ قبل الإيقاف، سيتم إغلاق الموارد على أي حال.")
+    await close_scraper_resources()
+    await db_async.close_db()
 
 # --- تشغيل البوت ---
 def main():
+    global scheduler_thread
     init_db()
     logger.info("تم تهيئة قاعدة البيانات") # استخدام logger
 
-    application = Application.builder().token(TOKEN).build()
+    application = Application.builder().token(TOKEN).post_shutdown(shutdown_resources).build()
     
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("alive", alive))
     application.add_handler(CommandHandler("update", manual_update))
 
-    threading.Thread(target=schedule_job, args=(application,), daemon=True).start()
+    scheduler_thread = threading.Thread(target=schedule_job, args=(application,), daemon=True)
+    scheduler_thread.start()
 
     logger.info("✅ البوت يعمل الآن مع 12 موقع سينمائي") # استخدام logger
     logger.info("⏱️ تحديث الأفلام كل ساعة تلقائياً") # استخدام logger
@@ -0,0 +1,192 @@
+import asyncio
+import itertools
+import logging
+import time
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+import config
+import db_async
+
+logger = logging.getLogger(__name__)
+
+# --- Broadcast engine ---
+# Fan-out time is set by Telegram's limits, not by a fixed sleep per user: every message takes a
+# token from one global bucket (BROADCAST_MESSAGES_PER_SECOND), messages to the same chat are spaced
+# by BROADCAST_PER_CHAT_INTERVAL_SECONDS, and BROADCAST_WORKERS coroutines keep requests in flight.
+# A RetryAfter pauses the whole bucket for as long as Telegram asks and puts the chat back in the
+# queue; network errors are retried with exponential backoff. Pending chats wait in a priority queue
+# ordered by the time they may be sent, so retries never hold up chats that can go out now.
+_bucket = None # Shared by all broadcasts of this process, since the limit is per bot
+
+def _get_bucket() -> dict:
+    """Returns the global token bucket, creating it full on first use."""
+    global _bucket
+    if _bucket is None:
+        _bucket = {
+            "rate": config.BROADCAST_MESSAGES_PER_SECOND,
+            "burst": config.BROADCAST_BURST,
+            "tokens": float(config.BROADCAST_BURST),
+            "updated": time.monotonic(),
+            "paused_until": 0.0,
+        }
+    return _bucket
+
+async def _take_token(bucket: dict):
+    """Waits until the global limit allows one more message, then consumes its token."""
+    while True:
+        now = time.monotonic()
+        if now < bucket["paused_until"]:
+            await asyncio.sleep(bucket["paused_until"] - now)
+            continue
+        bucket["tokens"] = min(bucket["burst"], bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"])
+        bucket["updated"] = now
+        if bucket["tokens"] >= 1:
+            bucket["tokens"] -= 1
+            return
+        await asyncio.sleep((1 - bucket["tokens"]) / bucket["rate"])
+
+def _pause_bucket(bucket: dict, seconds: float):
+    """Stops all sending for `seconds` (RetryAfter); the bucket refills only after the pause."""
+    resume_at = time.monotonic() + seconds
+    if resume_at > bucket["paused_until"]:
+        bucket["paused_until"] = resume_at
+        bucket["tokens"] = 0.0
+        bucket["updated"] = resume_at
+
+def _record_outcome(report: dict, job: dict, outcome: str):
+    """Counts how a chat's message ended: "delivered", "failed" or "blocked", and how many of its parts went out."""
+    report[outcome] += 1
+    report["outcomes"][job["index"]] = outcome
+    report["parts_sent"][job["index"]] = job["next_part"]
+    if outcome == "blocked":
+        report["blocked_chat_ids"].append(job["chat_id"])
+
+def _schedule_retry(queue: asyncio.PriorityQueue, sequence, job: dict, delay: float, report: dict) -> bool:
+    """Puts a chat back in the queue to be retried after `delay`; returns False once it is out of attempts."""
+    job["attempts"] += 1
+    if job["attempts"] >= config.BROADCAST_MAX_ATTEMPTS:
+        return False
+    report["retried"] += 1
+    queue.put_nowait((time.monotonic() + delay, next(sequence), job))
+    return True
+
+async def _send_job(bot, job: dict, queue: asyncio.PriorityQueue, sequence, last_sent_at: dict, report: dict, send_kwargs: dict):
+    """Sends the remaining parts of one chat's message in order and records how it ended."""
+    bucket = _get_bucket()
+    chat_id = job["chat_id"]
+    while job["next_part"] < len(job["texts"]):
+        wait = last_sent_at.get(chat_id, 0.0) + config.BROADCAST_PER_CHAT_INTERVAL_SECONDS - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await _take_token(bucket)
+        try:
+            await bot.send_message(chat_id=chat_id, text=job["texts"][job["next_part"]], **send_kwargs)
+        except RetryAfter as e:
+            logger.warning(f"⏳ Telegram asked to wait {e.retry_after}s (chat {chat_id}), pausing the broadcast.")
+            _pause_bucket(bucket, float(e.retry_after))
+            if not _schedule_retry(queue, sequence, job, float(e.retry_after), report):
+                _record_outcome(report, job, "failed")
+            return
+        except Forbidden as e:
+            logger.info(f"🚫 Chat {chat_id} blocked the bot or was deactivated: {e}")
+            _record_outcome(report, job, "blocked")
+            return
+        except BadRequest as e:
+            if "chat not found" in str(e).lower():
+                _record_outcome(report, job, "blocked")
+            else:
+                logger.error(f"❌ Telegram rejected the message for chat {chat_id}: {e}")
+                _record_outcome(report, job, "failed")
+            return
+        except NetworkError as e: # Includes TimedOut
+            backoff = config.BROADCAST_RETRY_BACKOFF_SECONDS * 2 ** job["attempts"]
+            if not _schedule_retry(queue, sequence, job, backoff, report):
+                logger.error(f"❌ Giving up on chat {chat_id} after {job['attempts']} attempts: {e}")
+                _record_outcome(report, job, "failed")
+            return
+        except Exception as e:
+            logger.error(f"❌ Error sending to chat {chat_id}: {e}")
+            _record_outcome(report, job, "failed")
+            return
+        last_sent_at[chat_id] = time.monotonic()
+        job["next_part"] += 1
+        job["attempts"] = 0 # Attempts are counted per message part
+    _record_outcome(report, job, "delivered")
+
+async def _broadcast_worker(bot, queue: asyncio.PriorityQueue, sequence, last_sent_at: dict, report: dict, send_kwargs: dict):
+    """Takes chats from the queue (earliest allowed send time first) until it is cancelled."""
+    while True:
+        not_before, _, job = await queue.get()
+        try:
+            delay = not_before - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await _send_job(bot, job, queue, sequence, last_sent_at, report, send_kwargs)
+        finally:
+            queue.task_done()
+
+async def broadcast_messages(bot, messages: list, **send_kwargs) -> dict:
+    """
+    Sends each chat its message as fast as Telegram's limits allow.
+    messages is a list of (chat_id, text), (chat_id, [text, ...]) or (chat_id, [text, ...], first_part);
+    the parts of a list go out in order, starting at first_part (parts an earlier attempt delivered).
+    send_kwargs are passed to bot.send_message (parse_mode, disable_web_page_preview...).
+    Returns {"delivered", "failed", "blocked", "retried", "outcomes", "parts_sent", "blocked_chat_ids", "seconds"};
+    delivered, failed and blocked count chats, outcomes holds each message's result in input order,
+    parts_sent how many of its parts have been delivered (including earlier attempts) and
+    blocked_chat_ids lists chats that blocked the bot or no longer exist.
+    """
+    started = time.monotonic()
+    report = {"delivered": 0, "failed": 0, "blocked": 0, "retried": 0,
+              "outcomes": [None] * len(messages), "parts_sent": [0] * len(messages), "blocked_chat_ids": []}
+    queue = asyncio.PriorityQueue()
+    sequence = itertools.count() # Tie-breaker, so jobs with the same send time are never compared
+    for index, (chat_id, texts, *first_part) in enumerate(messages):
+        job = {"index": index, "chat_id": chat_id, "texts": [texts] if isinstance(texts, str) else list(texts),
+               "next_part": first_part[0] if first_part else 0, "attempts": 0}
+        queue.put_nowait((0.0, next(sequence), job))
+
+    last_sent_at = {}
+    workers = [
+        asyncio.create_task(_broadcast_worker(bot, queue, sequence, last_sent_at, report, send_kwargs))
+        for _ in range(min(config.BROADCAST_WORKERS, max(1, queue.qsize())))
+    ]
+    try:
+        await queue.join()
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    report["seconds"] = round(time.monotonic() - started, 2)
+    logger.info(
+        f"📨 Broadcast to {len(messages)} chats in {report['seconds']}s: {report['delivered']} delivered, "
+        f"{report['failed']} failed, {report['blocked']} blocked, {report['retried']} retries."
+    )
+    return report
+
+async def drain_outbox(bot, **send_kwargs) -> dict:
+    """
+    Sends every pending notification of the outbox, OUTBOX_BATCH_SIZE at a time, and stores each
+    batch's outcomes before fetching the next, so after a restart sending resumes where it stopped.
+    Notifications that fail stay pending for the next drain (up to OUTBOX_MAX_ATTEMPTS), which resumes a
+    multi-part digest after the parts already delivered; users whose chat blocked the bot or no longer
+    exists are marked inactive.
+    Finished rows older than OUTBOX_RETENTION_DAYS are pruned afterwards.
+    Returns the broadcast counters summed over all batches.
+    """
+    totals = {"delivered": 0, "failed": 0, "blocked": 0, "retried": 0, "blocked_chat_ids": []}
+    last_id = 0 # Rows failing in this drain are not picked up again until the next one
+    while True:
+        batch = await db_async.get_pending_notifications(last_id, config.OUTBOX_BATCH_SIZE)
+        if not batch:
+            break
+        report = await broadcast_messages(bot, [(user_id, texts, parts_sent) for _, user_id, texts, parts_sent in batch], **send_kwargs)
+        await db_async.mark_notifications([(outbox_id, outcome, parts_sent) for (outbox_id, _, _, _), outcome, parts_sent
+                                           in zip(batch, report["outcomes"], report["parts_sent"])])
+        await db_async.deactivate_users(report["blocked_chat_ids"]) # Dead chats leave the recipient list (back on /start)
+        last_id = batch[-1][0]
+        for key in ("delivered", "failed", "blocked", "retried"):
+            totals[key] += report[key]
+        totals["blocked_chat_ids"].extend(report["blocked_chat_ids"])
+    await db_async.prune_outbox() # Finished rows past their retention; a drain runs every round, so each prune is small
+    return totals
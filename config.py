@@ -7,12 +7,67 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "7576844775:AAE8pDuHLQOz3HVOUoxIv3a_e685Ic2VZ
 ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID") # Set this env variable for admin features (e.g., '123456789')
 
 # --- Scraping and Scheduling Settings ---
-SCRAPE_INTERVAL_HOURS = 6 # How often to scrape for new movies (in hours)
+SCRAPE_INTERVAL_HOURS = 1 # How often to scrape for new movies (in hours); drives the scheduler and /alive's "next update"
 SELF_PING_INTERVAL_MINUTES = 5 # How often to ping the Flask server to keep the service alive (in minutes)
 DB_CLEANUP_TIME = "03:00" # Time of day for database cleanup (HH:MM format, 24-hour)
 MOVIE_RETENTION_DAYS = 90 # How many days to keep movie records in the database
+CLEANUP_BATCH_SIZE = 500 # Expired movies deleted per transaction, so each write lock is held only briefly
+CLEANUP_MAX_SECONDS = 30 # Time budget of one cleanup run; whatever is left is deleted by the next run
+CLEANUP_BATCH_PAUSE_SECONDS = 0.1 # Pause between delete batches to let bot queries through
+CLEANUP_VACUUM_PAGES = 2000 # Free pages returned to the file system per cleanup run (incremental vacuum)
+SCHEDULER_STOP_TIMEOUT_SECONDS = 20 # On shutdown, how long to wait for a running scheduled job before closing shared resources
 
-# --- Cache Settings (for scraped data to reduce redundant requests) ---
-# Cache expiry time for scraped main page data (in seconds)
-# This helps reduce repeated requests to websites within the scrape interval
-CACHE_EXPIRY_SECONDS = SCRAPE_INTERVAL_HOURS * 3600 
+# --- Database Settings ---
+# Each thread reuses one connection to the movies database (WAL journal, see db_manager.get_connection).
+DB_PATH = os.getenv("DB_PATH", "movies.db")
+DB_BUSY_TIMEOUT_SECONDS = 10 # How long a write waits for another writer's lock before failing with "database is locked"
+DB_CACHE_SIZE_KB = 16 * 1024 # Page cache per connection
+DB_MMAP_SIZE_BYTES = 128 * 1024 * 1024 # Memory-mapped I/O for reads; 0 disables it
+
+# --- Detail Page Pipeline Settings ---
+# Listing items are fed into one queue per host, each processed by that host's own workers.
+SCRAPE_MAX_CONCURRENCY = 12 # Maximum number of detail pages fetched at the same time (all sites combined)
+SCRAPE_PER_HOST_CONCURRENCY = 2 # Workers (and so detail pages fetched at the same time) per host
+SCRAPE_PER_HOST_DELAY_SECONDS = 0.5 # Polite delay a host's worker waits after each detail page
+SCRAPE_QUEUE_SIZE = 200 # Maximum number of listing items waiting for a worker, per host
+DETAIL_REFRESH_DAYS = 7 # Detail pages of movies already in the database are only re-fetched after this many days
+
+# --- HTML Parsing Settings ---
+# Where listing and detail pages are parsed: "process" (a pool of worker processes, parallel across cores),
+# "thread" (a thread pool; keeps the event loop responsive but shares one core) or "inline" (on the event loop).
+# Worker processes re-import the entry script, so "process" needs one whose start-up code is under
+# `if __name__ == '__main__'`; "thread" is the safe default on small single-core instances.
+PARSE_EXECUTOR = os.getenv("PARSE_EXECUTOR", "thread")
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "2")) # Number of parse workers (each process is a full interpreter); 0 means one per usable CPU core
+
+# --- HTTP Client Settings (shared session used by all scrapers) ---
+HTTP_CONNECTION_LIMIT = 40 # Maximum number of open connections across all hosts
+HTTP_CONNECTION_LIMIT_PER_HOST = 4 # Maximum number of open connections to a single host (listing + detail pages)
+HTTP_DNS_CACHE_SECONDS = 600 # How long resolved host addresses are reused
+HTTP_KEEPALIVE_SECONDS = 30 # How long idle connections are kept open for reuse
+HTTP_CONNECT_TIMEOUT_SECONDS = 10 # Budget for DNS lookup, TCP connect and TLS handshake
+HTTP_READ_TIMEOUT_SECONDS = 20 # Maximum wait between two reads of a response body
+HTTP_LISTING_TIMEOUT_SECONDS = 60 # Total budget for fetching a listing (main) page
+HTTP_DETAIL_TIMEOUT_SECONDS = 30 # Total budget for fetching a detail page
+HTTP_REUSE_SESSION = True # Keep one session (and its open connections) alive across scraping rounds
+
+# --- HTTP Cache Settings (for scraped pages to avoid re-downloading unchanged content) ---
+# Listing and detail pages are stored on disk with their ETag/Last-Modified validators and
+# re-requested conditionally; a 304 Not Modified response means the page is skipped.
+HTTP_CACHE_DB_PATH = os.getenv("HTTP_CACHE_DB_PATH", "http_cache.db")
+HTTP_CACHE_MAX_BYTES = 50 * 1024 * 1024 # Least recently used pages are evicted above this total size
+
+# --- Broadcast Settings (sending new-movie notifications to all users) ---
+# Messages go through a token bucket matched to Telegram's limits instead of a fixed sleep per user.
+BROADCAST_MESSAGES_PER_SECOND = 25 # Global send rate; Telegram allows about 30 messages per second per bot
+BROADCAST_BURST = 25 # Messages that may be sent back to back before the rate applies
+BROADCAST_PER_CHAT_INTERVAL_SECONDS = 1.0 # Minimum gap between two messages to the same chat
+BROADCAST_WORKERS = 16 # Sending coroutines; more only helps while API round trips, not the rate, are the bottleneck
+BROADCAST_MAX_ATTEMPTS = 4 # Tries per message (RetryAfter and network errors are retried) before it counts as failed
+BROADCAST_RETRY_BACKOFF_SECONDS = 2.0 # Wait before the first retry after a network error, doubled on each further retry
+
+# --- Notification Outbox Settings ---
+# Broadcasts are stored in the database before sending and drained in batches, so a restart resumes them.
+OUTBOX_BATCH_SIZE = 500 # Outbox rows sent per batch; each batch's outcomes are saved before the next one starts
+OUTBOX_MAX_ATTEMPTS = 3 # Drains a failed notification is retried in before it is given up
+OUTBOX_RETENTION_DAYS = 2 # Finished notifications are kept this long (pruned after each outbox drain)
@@ -0,0 +1,124 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import db_manager
+
+logger = logging.getLogger(__name__)
+
+# --- Async façade over db_manager ---
+# sqlite3 calls block, so coroutines (bot handlers, the scraper) never call db_manager directly.
+# Requests go to a single dedicated DB thread, which keeps one connection open (db_manager's
+# per-thread connection). All requests made during one event loop tick are sent to that thread
+# as one job, so a burst of handler queries costs one thread hand-off instead of one per query.
+_db_executor = None
+_pending_requests = {} # event loop -> [(func, args, kwargs, future), ...] waiting for the next tick
+
+def _get_db_executor() -> ThreadPoolExecutor:
+    """Returns the DB thread's executor, starting it on first use."""
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+    return _db_executor
+
+async def run_db(func, *args, **kwargs):
+    """Runs a db_manager function on the DB thread and awaits its result (or exception)."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    batch = _pending_requests.get(loop)
+    if batch is None:
+        batch = _pending_requests[loop] = []
+        loop.call_soon(_submit_pending_requests, loop)
+    batch.append((func, args, kwargs, future))
+    return await future
+
+def _submit_pending_requests(loop: asyncio.AbstractEventLoop):
+    """Sends everything requested during the last loop tick to the DB thread as one job."""
+    batch = _pending_requests.pop(loop, None)
+    if batch:
+        _get_db_executor().submit(_run_batch, loop, batch)
+
+def _run_batch(loop: asyncio.AbstractEventLoop, batch: list):
+    """DB thread: runs the requests in order and hands each result back to its event loop."""
+    for func, args, kwargs, future in batch:
+        if future.cancelled():
+            continue
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            loop.call_soon_threadsafe(_set_future_exception, future, e)
+        else:
+            loop.call_soon_threadsafe(_set_future_result, future, result)
+
+def _set_future_result(future: asyncio.Future, result):
+    if not future.done():
+        future.set_result(result)
+
+def _set_future_exception(future: asyncio.Future, exception: Exception):
+    if not future.done():
+        future.set_exception(exception)
+
+async def close_db():
+    """Closes the DB thread's connection and stops the thread. Awaited by bot.py's post_shutdown hook."""
+    global _db_executor
+    if _db_executor is not None:
+        await run_db(db_manager.close_connection)
+        _db_executor.shutdown(wait=True)
+        _db_executor = None
+
+def _on_db_thread(func):
+    """Async version of a db_manager function that runs on the DB thread."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+def _in_own_thread(func):
+    """
+    Async version of a long-running db_manager function (a whole scrape round, retention cleanup).
+    These run in a thread of their own, with their own connection, so they do not hold up the
+    short queries waiting for the DB thread; WAL lets those keep reading meanwhile.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return wrapper
+
+# Users and preferences
+add_user = _on_db_thread(db_manager.add_user)
+update_user_preference = _on_db_thread(db_manager.update_user_preference)
+get_user_preferences = _on_db_thread(db_manager.get_user_preferences)
+get_all_users_with_preferences = _on_db_thread(db_manager.get_all_users_with_preferences)
+deactivate_users = _on_db_thread(db_manager.deactivate_users)
+get_catalogue_counts = _on_db_thread(db_manager.get_catalogue_counts)
+get_bot_stats = _on_db_thread(db_manager.get_bot_stats)
+
+# Movies, search and ratings
+get_movie_by_url = _on_db_thread(db_manager.get_movie_by_url)
+get_movies_for_search = _on_db_thread(db_manager.get_movies_for_search)
+search_movies_page = _on_db_thread(db_manager.search_movies_page)
+group_movies_by_work = _on_db_thread(db_manager.group_movies_by_work)
+add_movie_rating = _on_db_thread(db_manager.add_movie_rating)
+get_user_rating = _on_db_thread(db_manager.get_user_rating)
+get_top_rated_movies = _on_db_thread(db_manager.get_top_rated_movies)
+
+# Favorites
+add_favorite = _on_db_thread(db_manager.add_favorite)
+remove_favorite = _on_db_thread(db_manager.remove_favorite)
+get_favorites = _on_db_thread(db_manager.get_favorites)
+get_favorites_page = _on_db_thread(db_manager.get_favorites_page)
+
+# Notification outbox
+get_pending_announcements = _on_db_thread(db_manager.get_pending_announcements)
+enqueue_notifications = _on_db_thread(db_manager.enqueue_notifications)
+get_pending_notifications = _on_db_thread(db_manager.get_pending_notifications)
+mark_notifications = _on_db_thread(db_manager.mark_notifications)
+prune_outbox = _in_own_thread(db_manager.prune_outbox)
+
+# Scraping
+get_site_statuses = _on_db_thread(db_manager.get_site_statuses)
+get_fresh_movie_urls = _on_db_thread(db_manager.get_fresh_movie_urls)
+get_stored_movie_urls = _on_db_thread(db_manager.get_stored_movie_urls)
+record_scrape_round = _on_db_thread(db_manager.record_scrape_round)
+upsert_movies_batch = _in_own_thread(db_manager.upsert_movies_batch)
+cleanup_old_movies = _in_own_thread(db_manager.cleanup_old_movies)
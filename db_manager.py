@@ -1,145 +1,465 @@
 import sqlite3
-from datetime import datetime, timedelta
+import threading
+import time
+import calendar
+import json
+from datetime import datetime, timedelta, timezone
 import logging
 import config # New: Import configuration settings
+from utils import ARABIC_NORMALIZATION_MAP, normalize_arabic, make_search_key, make_work_block_key
 
 logger = logging.getLogger(__name__)
 
-def init_db():
+# --- Connection management ---
+# Opening a connection per call costs a file open plus schema parsing, so every thread keeps one
+# connection to config.DB_PATH and reuses it. The database runs in WAL mode: readers (bot handlers)
+# no longer block on the scraper's writes, and commits only fsync the log.
+_local = threading.local()
+
+def _open_connection() -> sqlite3.Connection:
+    """Opens a connection to the movies database and applies the per-connection pragmas."""
+    conn = sqlite3.connect(config.DB_PATH, timeout=config.DB_BUSY_TIMEOUT_SECONDS)
+    conn.execute("PRAGMA journal_mode=WAL") # Persistent, but cheap to re-assert
+    conn.execute("PRAGMA synchronous=NORMAL") # Safe with WAL: a crash can only lose the last commits, never corrupt
+    conn.execute(f"PRAGMA cache_size=-{int(config.DB_CACHE_SIZE_KB)}")
+    conn.execute(f"PRAGMA mmap_size={int(config.DB_MMAP_SIZE_BYTES)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+# --- Full-text search ---
+# movies_fts is a contentless FTS5 index over title/description/genres, kept in sync by triggers on movies.
+# The indexed text is Arabic-normalized in SQL inside the triggers (the same mapping as utils.normalize_arabic,
+# which is applied to queries), so spelling variants match. The trigram tokenizer matches query words anywhere
+# inside a word, so "رحلة" finds "الرحلة" (attached article and clitics) and "venger" finds "Avengers".
+_FTS_COLUMN_WEIGHTS = (10.0, 1.0, 5.0) # bm25 weights for title, description, genres
+_FTS_MIN_TERM_LENGTH = 3 # Trigrams cannot match shorter words; queries made only of those use LIKE
+_SEARCH_INDEX_TABLE = """CREATE VIRTUAL TABLE movies_fts
+                 USING fts5(title, description, genres, content='', tokenize='trigram')"""
+
+def _normalize_arabic_sql(expression: str) -> str:
+    """Wraps an SQL expression in REPLACE() calls that apply ARABIC_NORMALIZATION_MAP."""
+    for source_char, target_char in ARABIC_NORMALIZATION_MAP.items():
+        expression = f"REPLACE({expression}, '{source_char}', '{target_char}')"
+    return expression
+
+def _fts_values_sql(row: str) -> str:
+    """The indexed values of a movies row (NEW, OLD or the table itself) for movies_fts."""
+    return ", ".join(_normalize_arabic_sql(f"COALESCE({row}.{column}, '')") for column in ("title", "description", "genres"))
+
+_SEARCH_INDEX_TRIGGERS = {
+    "movies_fts_insert": f"""CREATE TRIGGER movies_fts_insert AFTER INSERT ON movies BEGIN
+    INSERT INTO movies_fts (rowid, title, description, genres) VALUES (NEW.id, {_fts_values_sql('NEW')});
+END""",
+    "movies_fts_delete": f"""CREATE TRIGGER movies_fts_delete AFTER DELETE ON movies BEGIN
+    INSERT INTO movies_fts (movies_fts, rowid, title, description, genres) VALUES ('delete', OLD.id, {_fts_values_sql('OLD')});
+END""",
+    "movies_fts_update": f"""CREATE TRIGGER movies_fts_update AFTER UPDATE OF title, description, genres ON movies BEGIN
+    INSERT INTO movies_fts (movies_fts, rowid, title, description, genres) VALUES ('delete', OLD.id, {_fts_values_sql('OLD')});
+    INSERT INTO movies_fts (rowid, title, description, genres) VALUES (NEW.id, {_fts_values_sql('NEW')});
+END""",
+}
+
+def _search_index_is_current(c: sqlite3.Cursor) -> bool:
+    """Whether movies_fts and its triggers exist exactly as defined here (same tokenizer, same normalization)."""
+    stored_table = c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'movies_fts'").fetchone()
+    stored_triggers = dict(c.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'movies_fts_%'").fetchall())
+    return bool(stored_table) and stored_table[0] == _SEARCH_INDEX_TABLE and stored_triggers == _SEARCH_INDEX_TRIGGERS
+
+def _create_search_index(c: sqlite3.Cursor):
     """
-    Initializes the SQLite database, creating tables and adding indexes if they don't exist.
-    Tables: movies, users, site_status, favorites.
+    Creates movies_fts and its sync triggers. The index is (re)built from the movies table when it is new
+    or when the table or trigger definitions changed, since rows indexed the old way would no longer match.
+    init_db runs this check on every startup, so an edit to ARABIC_NORMALIZATION_MAP or the tokenizer
+    rebuilds the index without a new migration.
     """
-    conn = sqlite3.connect('movies.db')
-    c = conn.cursor()
+    if _search_index_is_current(c):
+        return
 
-    # --- Movies Table ---
-    c.execute('''CREATE TABLE IF NOT EXISTS movies
-                (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 title TEXT NOT NULL,
-                 url TEXT NOT NULL UNIQUE,
-                 source TEXT NOT NULL,
-                 image_url TEXT,
-                 category TEXT,
-                 description TEXT,
-                 release_year INTEGER,
-                 average_rating REAL DEFAULT 0.0,
-                 rating_count INTEGER DEFAULT 0,
-                 genres TEXT, -- New: to store comma-separated genres
-                 last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-    
-    # Add new columns if they don't exist (for schema evolution)
-    try:
-        c.execute("ALTER TABLE movies ADD COLUMN category TEXT")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" not in str(e):
-            logger.error(f"Error altering movies table to add category column: {e}")
+    stored_triggers = [row[0] for row in c.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'movies_fts_%'")]
+    for trigger_name in stored_triggers:
+        c.execute(f"DROP TRIGGER {trigger_name}")
+    c.execute("DROP TABLE IF EXISTS movies_fts")
+    c.execute(_SEARCH_INDEX_TABLE)
+    for trigger_sql in _SEARCH_INDEX_TRIGGERS.values():
+        c.execute(trigger_sql)
+    c.execute(f"INSERT INTO movies_fts (rowid, title, description, genres) SELECT id, {_fts_values_sql('movies')} FROM movies")
+    logger.info(f"Built full-text search index for {c.rowcount} movies.")
 
-    try:
-        c.execute("ALTER TABLE movies ADD COLUMN image_url TEXT")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" not in str(e):
-            logger.error(f"Error altering movies table to add image_url column: {e}")
-            
-    try:
-        c.execute("ALTER TABLE movies ADD COLUMN description TEXT")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" not in str(e):
-            logger.error(f"Error altering movies table to add description column: {e}")
-            
-    try:
-        c.execute("ALTER TABLE movies ADD COLUMN release_year INTEGER")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" not in str(e):
-            logger.error(f"Error altering movies table to add release_year column: {e}")
+def _backfill_title_keys(c: sqlite3.Cursor):
+    """Fills title_key for movies stored before the column existed."""
+    rows = c.execute("SELECT id, title FROM movies WHERE title_key IS NULL").fetchall()
+    if rows:
+        c.executemany("UPDATE movies SET title_key = ? WHERE id = ?", [(make_search_key(title), movie_id) for movie_id, title in rows])
+        logger.info(f"Filled search keys for {len(rows)} movies.")
 
+def _assign_work_ids(c: sqlite3.Cursor) -> int:
+    """
+    Links every movie without a work_id to a work, creating works as needed. Incremental: only
+    unassigned movies are looked at. Candidates come from the movie's blocking key bucket
+    (utils.make_work_block_key) and match when the release years agree or one of them is unknown.
+    Returns the number of movies assigned.
+    """
+    rows = c.execute("SELECT id, title, category, release_year FROM movies WHERE work_id IS NULL").fetchall()
+    if not rows:
+        return 0
+    now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+    buckets = {} # block_key -> [[work_id, release_year], ...], loaded once per key
+    assignments = []
+    for movie_id, title, category, release_year in rows:
+        block_key = make_work_block_key(title, category)
+        if block_key not in buckets:
+            buckets[block_key] = [list(work) for work in c.execute("SELECT id, release_year FROM works WHERE block_key = ?", (block_key,))]
+        candidates = buckets[block_key]
+
+        work = next((w for w in candidates if w[1] == release_year), None)
+        if work is None:
+            work = next((w for w in candidates if w[1] is None or release_year is None), None)
+        if work is None:
+            c.execute("INSERT INTO works (block_key, release_year, created_at) VALUES (?, ?, ?)", (block_key, release_year, now_str))
+            work = [c.lastrowid, release_year]
+            candidates.append(work)
+        elif work[1] is None and release_year is not None:
+            c.execute("UPDATE works SET release_year = ? WHERE id = ?", (release_year, work[0]))
+            work[1] = release_year
+        assignments.append((work[0], movie_id))
+
+    c.executemany("UPDATE movies SET work_id = ? WHERE id = ?", assignments)
+    return len(assignments)
+
+def _get_work_sources(c: sqlite3.Cursor, work_ids: list) -> dict:
+    """Returns {work_id: [(source, url), ...]} with every stored copy of the given works, newest first."""
+    work_sources = {}
+    unique_ids = list(set(work_ids))
+    for i in range(0, len(unique_ids), 500):
+        chunk = unique_ids[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        c.execute(f"SELECT work_id, source, url FROM movies WHERE work_id IN ({placeholders}) ORDER BY last_updated DESC", chunk)
+        for work_id, source, url in c.fetchall():
+            work_sources.setdefault(work_id, []).append((source, url))
+    return work_sources
+
+def _fts_match_query(query_text: str) -> str:
+    """
+    Turns user input into an FTS5 query for the trigram index: every word must occur somewhere in the text
+    (so partial words and words with an attached article still match). Words are quoted, so FTS5 operators
+    and punctuation in the input are taken literally. Words shorter than _FTS_MIN_TERM_LENGTH cannot be
+    matched by trigrams and are left out; returns "" when no word is long enough.
+    """
+    words = [word for word in normalize_arabic(query_text).split() if len(word) >= _FTS_MIN_TERM_LENGTH]
+    return " ".join('"' + word.replace('"', '""') + '"' for word in words)
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Returns this thread's connection to the movies database, opening it on first use.
+    A transaction left open by a failed call is rolled back before the connection is handed out again.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != config.DB_PATH:
+        if conn is not None: # DB_PATH changed since this thread connected
+            conn.close()
+        conn = _open_connection()
+        _local.conn = conn
+        _local.path = config.DB_PATH
+    elif conn.in_transaction:
+        conn.rollback()
+    return conn
+
+def _release(conn: sqlite3.Connection):
+    """Hands a connection back after a call: discards any uncommitted work but keeps the connection open."""
+    if conn.in_transaction:
+        conn.rollback()
+
+def close_connection():
+    """Closes this thread's connection (e.g. on shutdown); the next call opens a fresh one."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+# --- Schema migrations ---
+# The schema version is stored in PRAGMA user_version. init_db() applies every migration above it in order,
+# each in its own transaction together with the version bump, so a crash never leaves a half-applied step.
+# Never edit a released migration; append a new one instead.
+
+_MOVIES_COLUMNS = {
+    "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+    "title": "TEXT NOT NULL",
+    "url": "TEXT NOT NULL UNIQUE",
+    "source": "TEXT NOT NULL",
+    "image_url": "TEXT",
+    "category": "TEXT",
+    "description": "TEXT",
+    "release_year": "INTEGER",
+    "average_rating": "REAL DEFAULT 0.0",
+    "rating_count": "INTEGER DEFAULT 0",
+    "genres": "TEXT", # Comma-separated genres
+    "last_updated": "TIMESTAMP DEFAULT CURRENT_TIMESTAMP",
+    "details_fetched_at": "TIMESTAMP", # When the detail page was last visited
+    "title_key": "TEXT", # Normalized title for search (utils.make_search_key)
+    "work_id": "INTEGER", # Same release across sources (see works)
+}
+_USERS_COLUMNS = {
+    "user_id": "INTEGER PRIMARY KEY",
+    "username": "TEXT",
+    "first_name": "TEXT",
+    "last_name": "TEXT",
+    "join_date": "TIMESTAMP DEFAULT CURRENT_TIMESTAMP",
+    "receive_movies": "INTEGER DEFAULT 1",
+    "receive_series": "INTEGER DEFAULT 1",
+    "receive_anime": "INTEGER DEFAULT 1",
+}
+_SITE_STATUS_COLUMNS = {
+    "site_name": "TEXT PRIMARY KEY",
+    "last_scraped": "TIMESTAMP",
+    "status": "TEXT DEFAULT 'unknown'",
+    "last_error": "TEXT",
+}
+
+def _create_or_complete_table(c: sqlite3.Cursor, table: str, columns: dict, constraints: str = ""):
+    """
+    Creates a table, or adds the columns an older copy of it is missing. Databases created before
+    migrations existed (by db_manager or by the old bot.py) can be at any point of the schema's history.
+    """
+    existing_columns = {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+    if not existing_columns:
+        definitions = [f"{name} {declaration}" for name, declaration in columns.items()]
+        if constraints:
+            definitions.append(constraints)
+        c.execute(f"CREATE TABLE {table} ({', '.join(definitions)})")
+        return
+    for name, declaration in columns.items():
+        if name not in existing_columns:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+
+def _migration_1_baseline(c: sqlite3.Cursor):
+    """Brings a new or pre-migration database to the baseline schema."""
+    _create_or_complete_table(c, "movies", _MOVIES_COLUMNS)
+    _create_or_complete_table(c, "users", _USERS_COLUMNS)
+    _create_or_complete_table(c, "site_status", _SITE_STATUS_COLUMNS)
+    _create_or_complete_table(c, "favorites", {
+        "user_id": "INTEGER NOT NULL",
+        "movie_url": "TEXT NOT NULL",
+        "added_date": "TIMESTAMP DEFAULT CURRENT_TIMESTAMP",
+    }, "PRIMARY KEY (user_id, movie_url), FOREIGN KEY (user_id) REFERENCES users(user_id), FOREIGN KEY (movie_url) REFERENCES movies(url)")
+    _create_or_complete_table(c, "works", { # One row per release, shared by its copies on different sources
+        "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+        "block_key": "TEXT NOT NULL",
+        "release_year": "INTEGER",
+        "created_at": "TIMESTAMP NOT NULL",
+    })
+    _backfill_title_keys(c)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_works_block_key ON works (block_key)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_movies_work_id ON movies (work_id)")
+    _assign_work_ids(c)
+
+def _migration_2_query_indexes(c: sqlite3.Cursor):
+    """Replaces the single-column indexes with the ones the hot queries use."""
+    c.execute("DROP INDEX IF EXISTS idx_movies_url") # Duplicates the UNIQUE constraint's index
+    c.execute("DROP INDEX IF EXISTS idx_movies_title") # Title lookups go through title_key / movies_fts
+    c.execute("DROP INDEX IF EXISTS idx_movies_category")
+    c.execute("DROP INDEX IF EXISTS idx_favorites_user_id")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_movies_last_updated ON movies (last_updated)") # Retention cleanup
+    c.execute("CREATE INDEX IF NOT EXISTS idx_movies_title_key ON movies (title_key)") # Title prefix search
+    c.execute("CREATE INDEX IF NOT EXISTS idx_movies_category_last_updated ON movies (category, last_updated)") # Latest per category
+    c.execute("CREATE INDEX IF NOT EXISTS idx_favorites_user_added ON favorites (user_id, added_date)") # A user's favorites, newest first
+
+def _migration_3_search_index(c: sqlite3.Cursor):
+    """Full-text search index (search falls back to LIKE if this SQLite build has no FTS5)."""
     try:
-        c.execute("ALTER TABLE movies ADD COLUMN average_rating REAL DEFAULT 0.0")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" not in str(e):
-            logger.error(f"Error altering movies table to add average_rating column: {e}")
-            
-    try:
-        c.execute("ALTER TABLE movies ADD COLUMN rating_count INTEGER DEFAULT 0")
-    except sqlite3.OperationalError as e:
-        if "duplicate column name" not in str(e):
-            logger.error(f"Error altering movies table to add rating_count column: {e}")
-    
-    try:
-        c.execute("ALTER TABLE movies ADD COLUMN genres TEXT") # New: genres column
+        _create_search_index(c)
     except sqlite3.OperationalError as e:
-        if "duplicate column name" not in str(e):
-            logger.error(f"Error altering movies table to add genres column: {e}")
-
-    # Create indexes for faster lookups on common query columns
-    c.execute("CREATE INDEX IF NOT EXISTS idx_movies_url ON movies (url)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_movies_title ON movies (title)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_movies_category ON movies (category)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_movies_last_updated ON movies (last_updated)")
-
-    # --- Users Table ---
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                (user_id INTEGER PRIMARY KEY,
-                 username TEXT,
-                 first_name TEXT,
-                 last_name TEXT,
-                 join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                 receive_movies INTEGER DEFAULT 1,
-                 receive_series INTEGER DEFAULT 1,
-                 receive_anime INTEGER DEFAULT 1)''')
-    
-    # Add preference columns if they don't exist
-    for col in ['receive_movies', 'receive_series', 'receive_anime']:
+        logger.error(f"Could not create full-text search index, search will scan the movies table: {e}")
+
+def _migration_4_ratings(c: sqlite3.Cursor):
+    """Per-user ratings table; the movie's sum/count/average are maintained by triggers."""
+    c.execute("""CREATE TABLE ratings
+                 (user_id INTEGER NOT NULL,
+                  movie_url TEXT NOT NULL,
+                  rating INTEGER NOT NULL,
+                  rated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                  PRIMARY KEY (user_id, movie_url))""")
+    c.execute("ALTER TABLE movies ADD COLUMN rating_sum INTEGER DEFAULT 0")
+    # Ratings given before this table existed have no user; keep them in the aggregate
+    c.execute("UPDATE movies SET rating_sum = CAST(ROUND(COALESCE(average_rating, 0) * COALESCE(rating_count, 0)) AS INTEGER)")
+    # UPDATE ... SET expressions see the row's old values, so each trigger is one atomic read-modify-write
+    c.execute("""CREATE TRIGGER ratings_insert AFTER INSERT ON ratings BEGIN
+    UPDATE movies SET rating_sum = rating_sum + NEW.rating, rating_count = rating_count + 1,
+                      average_rating = (rating_sum + NEW.rating) * 1.0 / (rating_count + 1)
+    WHERE url = NEW.movie_url;
+END""")
+    c.execute("""CREATE TRIGGER ratings_update AFTER UPDATE OF rating ON ratings BEGIN
+    UPDATE movies SET rating_sum = rating_sum + NEW.rating - OLD.rating,
+                      average_rating = (rating_sum + NEW.rating - OLD.rating) * 1.0 / rating_count
+    WHERE url = NEW.movie_url;
+END""")
+    c.execute("""CREATE TRIGGER ratings_delete AFTER DELETE ON ratings BEGIN
+    UPDATE movies SET rating_sum = rating_sum - OLD.rating, rating_count = rating_count - 1,
+                      average_rating = CASE WHEN rating_count > 1 THEN (rating_sum - OLD.rating) * 1.0 / (rating_count - 1) ELSE 0.0 END
+    WHERE url = OLD.movie_url;
+END""")
+    # Top-rated list: an ordered scan of this partial index, no sort
+    c.execute("CREATE INDEX idx_movies_top_rated ON movies (average_rating DESC, rating_count DESC) WHERE rating_count > 0")
+
+def _migration_5_stats(c: sqlite3.Cursor):
+    """Trigger-maintained row counters and a log of scrape rounds, so /alive reads a few rows instead of scanning."""
+    c.execute("CREATE TABLE stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID")
+    c.execute("INSERT INTO stats (name, value) SELECT 'movies', COUNT(*) FROM movies")
+    c.execute("INSERT INTO stats (name, value) SELECT 'users', COUNT(*) FROM users")
+    for table in ("movies", "users"):
+        c.execute(f"""CREATE TRIGGER stats_{table}_insert AFTER INSERT ON {table} BEGIN
+    UPDATE stats SET value = value + 1 WHERE name = '{table}';
+END""")
+        c.execute(f"""CREATE TRIGGER stats_{table}_delete AFTER DELETE ON {table} BEGIN
+    UPDATE stats SET value = value - 1 WHERE name = '{table}';
+END""")
+    c.execute("""CREATE TABLE scrape_rounds
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  entry_point TEXT NOT NULL,
+                  started_at TIMESTAMP NOT NULL,
+                  finished_at TIMESTAMP NOT NULL,
+                  duration_seconds REAL NOT NULL,
+                  items_processed INTEGER NOT NULL,
+                  new_movies INTEGER NOT NULL,
+                  sites_ok INTEGER NOT NULL,
+                  sites_failed INTEGER NOT NULL)""")
+
+def _migration_6_outbox(c: sqlite3.Cursor):
+    """Durable notification outbox: one row per recipient, pointing at a digest stored once per group."""
+    c.execute("""CREATE TABLE notification_payloads
+                 (id INTEGER PRIMARY KEY,
+                  texts TEXT NOT NULL,
+                  created_at TIMESTAMP NOT NULL)""")
+    c.execute("""CREATE TABLE outbox
+                 (id INTEGER PRIMARY KEY,
+                  user_id INTEGER NOT NULL,
+                  payload_id INTEGER NOT NULL,
+                  state TEXT NOT NULL DEFAULT 'pending',
+                  attempts INTEGER NOT NULL DEFAULT 0,
+                  created_at TIMESTAMP NOT NULL,
+                  updated_at TIMESTAMP NOT NULL)""")
+    # The sender reads pending rows in id order; finished rows drop out of this index
+    c.execute("CREATE INDEX idx_outbox_pending ON outbox (id) WHERE state = 'pending'")
+    c.execute("CREATE INDEX idx_outbox_payload ON outbox (payload_id)")
+
+def _migration_7_user_activity(c: sqlite3.Cursor):
+    """Active flag on users, cleared when their chat blocks the bot or disappears."""
+    c.execute("ALTER TABLE users ADD COLUMN is_active INTEGER NOT NULL DEFAULT 1")
+    c.execute("ALTER TABLE users ADD COLUMN deactivated_at TIMESTAMP")
+
+def _migration_8_announce_pending(c: sqlite3.Cursor):
+    """Marks new movies whose notification is not yet in the outbox, written with the movie itself."""
+    c.execute("ALTER TABLE movies ADD COLUMN announce_pending INTEGER NOT NULL DEFAULT 0")
+    c.execute("CREATE INDEX idx_movies_announce_pending ON movies (id) WHERE announce_pending = 1")
+
+def _migration_9_outbox_user_index(c: sqlite3.Cursor):
+    """Indexes pending outbox rows by user, so deactivate_users closes a user's rows without a table scan."""
+    c.execute("CREATE INDEX idx_outbox_user_pending ON outbox (user_id) WHERE state = 'pending'")
+
+def _migration_10_trigram_search_index(c: sqlite3.Cursor):
+    """Rebuilds the full-text search index with the trigram tokenizer (substring matches)."""
+    _migration_3_search_index(c)
+
+def _migration_11_outbox_parts_sent(c: sqlite3.Cursor):
+    """Number of message parts already delivered per outbox row, so a retried digest resumes after them."""
+    c.execute("ALTER TABLE outbox ADD COLUMN parts_sent INTEGER NOT NULL DEFAULT 0")
+
+def _migration_12_title_keys_without_article(c: sqlite3.Cursor):
+    """Recomputes title_key now that make_search_key drops the attached Arabic article."""
+    rows = c.execute("SELECT id, title FROM movies").fetchall()
+    c.executemany("UPDATE movies SET title_key = ? WHERE id = ?", [(make_search_key(title), movie_id) for movie_id, title in rows])
+
+MIGRATIONS = [
+    (1, _migration_1_baseline),
+    (2, _migration_2_query_indexes),
+    (3, _migration_3_search_index),
+    (4, _migration_4_ratings),
+    (5, _migration_5_stats),
+    (6, _migration_6_outbox),
+    (7, _migration_7_user_activity),
+    (8, _migration_8_announce_pending),
+    (9, _migration_9_outbox_user_index),
+    (10, _migration_10_trigram_search_index),
+    (11, _migration_11_outbox_parts_sent),
+    (12, _migration_12_title_keys_without_article),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """Applies the migrations newer than the database's user_version. Returns the number applied."""
+    applied_count = 0
+    for version, migration in MIGRATIONS:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE") # Take the write lock first, so two starting processes apply each step once
         try:
-            c.execute(f"ALTER TABLE users ADD COLUMN {col} INTEGER DEFAULT 1")
-        except sqlite3.OperationalError as e:
-            if "duplicate column name" not in str(e):
-                logger.error(f"Error altering users table to add {col} column: {e}")
-
-    # --- Site Status Table ---
-    c.execute('''CREATE TABLE IF NOT EXISTS site_status
-                (site_name TEXT PRIMARY KEY,
-                 last_scraped TIMESTAMP,
-                 status TEXT DEFAULT 'unknown',
-                 last_error TEXT)''')
-    
-    # Add last_error column if it doesn't exist
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                conn.rollback()
+                continue
+            migration(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.critical(f"Database migration {version} ({migration.__name__}) failed.")
+            raise
+        applied_count += 1
+        logger.info(f"Applied database migration {version}: {migration.__doc__.splitlines()[0]}")
+    return applied_count
+
+def _refresh_search_index(conn: sqlite3.Connection):
+    """Rebuilds movies_fts if its definition no longer matches the code (e.g. ARABIC_NORMALIZATION_MAP was edited)."""
     try:
-        c.execute("ALTER TABLE site_status ADD COLUMN last_error TEXT")
+        if _search_index_is_current(conn.cursor()):
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _create_search_index(conn.cursor()) # Checks again under the write lock
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
     except sqlite3.OperationalError as e:
-        if "duplicate column name" not in str(e):
-            logger.error(f"Error altering site_status table to add last_error column: {e}")
-
-    # --- Favorites Table (New) ---
-    c.execute('''CREATE TABLE IF NOT EXISTS favorites
-                (user_id INTEGER NOT NULL,
-                 movie_url TEXT NOT NULL,
-                 added_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                 PRIMARY KEY (user_id, movie_url),
-                 FOREIGN KEY (user_id) REFERENCES users(user_id),
-                 FOREIGN KEY (movie_url) REFERENCES movies(url))''')
-    
-    # Create index for faster lookup of favorites by user
-    c.execute("CREATE INDEX IF NOT EXISTS idx_favorites_user_id ON favorites (user_id)")
+        logger.error(f"Could not rebuild full-text search index, search will scan the movies table: {e}")
 
+def init_db():
+    """
+    Initializes the SQLite database: applies pending schema migrations (see MIGRATIONS).
+    Tables: movies, users, site_status, favorites, works (plus the movies_fts search index).
+    This is the only schema definition; every entry point (bot.py included) calls it on startup.
+    """
+    conn = get_connection()
+    c = conn.cursor()
 
-    conn.commit()
-    conn.close()
-    logger.info("Database initialized successfully.")
+    # Free pages are returned to the OS in small steps by cleanup_old_movies (PRAGMA incremental_vacuum)
+    # instead of a full VACUUM. Switching an existing database over needs one last full VACUUM.
+    if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        c.execute("VACUUM")
+        logger.info("Database switched to incremental auto-vacuum.")
+
+    apply_migrations(conn)
+    _refresh_search_index(conn)
+    _release(conn)
+    logger.info(f"Database initialized successfully (schema version {SCHEMA_VERSION}).")
 
 def add_user(user_id: int, username: str, first_name: str, last_name: str):
-    """Adds a new user or updates an existing user's details."""
-    conn = sqlite3.connect('movies.db')
+    """Adds a new user or updates an existing user's details, reactivating a user marked inactive."""
+    conn = get_connection()
     c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, receive_movies, receive_series, receive_anime) VALUES (?, ?, ?, ?, 1, 1, 1)",
-              (user_id, username, first_name, last_name))
+    c.execute("""
+        INSERT INTO users (user_id, username, first_name, last_name, receive_movies, receive_series, receive_anime)
+        VALUES (?, ?, ?, ?, 1, 1, 1)
+        ON CONFLICT(user_id) DO UPDATE
+        SET username = excluded.username, first_name = excluded.first_name, last_name = excluded.last_name,
+            is_active = 1, deactivated_at = NULL
+    """, (user_id, username, first_name, last_name))
     conn.commit()
-    conn.close()
+    _release(conn)
     logger.info(f"User added/updated: {user_id}")
 
 def update_user_preference(user_id: int, preference_type: str, value: int) -> bool:
     """Updates a specific preference (e.g., receive_movies) for a user."""
-    conn = sqlite3.connect('movies.db')
+    conn = get_connection()
     c = conn.cursor()
     try:
         c.execute(f"UPDATE users SET {preference_type} = ? WHERE user_id = ?", (value, user_id))
@@ -150,157 +470,526 @@ def update_user_preference(user_id: int, preference_type: str, value: int) -> bo
         logger.error(f"Error updating user preference {user_id} for {preference_type}: {e}")
         return False
     finally:
-        conn.close()
+        _release(conn)
 
 def get_user_preferences(user_id: int) -> dict:
     """Retrieves notification preferences for a given user."""
-    conn = sqlite3.connect('movies.db')
+    conn = get_connection()
     c = conn.cursor()
     c.execute("SELECT receive_movies, receive_series, receive_anime FROM users WHERE user_id = ?", (user_id,))
     prefs = c.fetchone()
-    conn.close()
+    _release(conn)
     if prefs:
         return {"movies": bool(prefs[0]), "series": bool(prefs[1]), "anime": bool(prefs[2])}
     return {"movies": True, "series": True, "anime": True} # Default preferences
 
 def update_site_status(site_name: str, status: str, error_message: str = None):
     """Updates the scraping status and last error for a given site."""
-    conn = sqlite3.connect('movies.db')
+    conn = get_connection()
     c = conn.cursor()
     current_time_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
     c.execute("INSERT OR REPLACE INTO site_status (site_name, last_scraped, status, last_error) VALUES (?, ?, ?, ?)",
               (site_name, current_time_str, status, error_message))
     conn.commit()
-    conn.close()
+    _release(conn)
 
 def get_site_statuses() -> list:
     """Retrieves the scraping status for all sites."""
-    conn = sqlite3.connect('movies.db')
+    conn = get_connection()
     c = conn.cursor()
     c.execute("SELECT site_name, last_scraped, status, last_error FROM site_status")
     statuses = c.fetchall()
-    conn.close()
+    _release(conn)
     return statuses
 
-def cleanup_old_movies():
-    """Deletes movies older than MOVIE_RETENTION_DAYS from the database and vacuums."""
-    conn = sqlite3.connect('movies.db')
+def cleanup_old_movies() -> int:
+    """
+    Deletes movies older than MOVIE_RETENTION_DAYS in small batches, each in its own short transaction,
+    together with the favorites pointing at them and works left without movies. Stops after
+    CLEANUP_MAX_SECONDS (the rest goes next run) and then frees up to CLEANUP_VACUUM_PAGES pages.
+    Returns the number of movies deleted.
+    """
+    conn = get_connection()
     c = conn.cursor()
-    
-    retention_date = datetime.now() - timedelta(days=config.MOVIE_RETENTION_DAYS)
-    c.execute("DELETE FROM movies WHERE last_updated < ?", (retention_date,))
-    deleted_count = c.rowcount
-    
+    retention_date_str = (datetime.now() - timedelta(days=config.MOVIE_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    deadline = time.monotonic() + config.CLEANUP_MAX_SECONDS
+    deleted_count = 0
     try:
-        c.execute("VACUUM")
-        logger.info("VACUUM executed successfully on the database.")
-    except Exception as e:
-        logger.error(f"Error during VACUUM: {e}")
+        while True:
+            batch = c.execute("SELECT id, url, work_id FROM movies WHERE last_updated < ? ORDER BY last_updated LIMIT ?",
+                              (retention_date_str, config.CLEANUP_BATCH_SIZE)).fetchall()
+            if not batch:
+                break
+            c.executemany("DELETE FROM favorites WHERE movie_url = ?", [(url,) for _, url, _ in batch])
+            c.executemany("DELETE FROM ratings WHERE movie_url = ?", [(url,) for _, url, _ in batch])
+            c.executemany("DELETE FROM movies WHERE id = ?", [(movie_id,) for movie_id, _, _ in batch])
+            c.executemany("DELETE FROM works WHERE id = ? AND NOT EXISTS (SELECT 1 FROM movies WHERE movies.work_id = works.id)",
+                          [(work_id,) for work_id in {work_id for _, _, work_id in batch if work_id is not None}])
+            conn.commit()
+            deleted_count += len(batch)
+            if len(batch) < config.CLEANUP_BATCH_SIZE:
+                break
+            if time.monotonic() >= deadline:
+                logger.info("Cleanup time budget used up, remaining old movies will be deleted in the next run.")
+                break
+            time.sleep(config.CLEANUP_BATCH_PAUSE_SECONDS)
 
-    conn.commit()
-    conn.close()
+        # Favorites whose movie disappeared some other way (e.g. before favorites were cleaned up with their movies)
+        c.execute("DELETE FROM favorites WHERE NOT EXISTS (SELECT 1 FROM movies WHERE movies.url = favorites.movie_url)")
+        conn.commit()
+
+        # executescript steps the pragma to completion; execute() would stop after freeing a single page
+        conn.executescript(f"PRAGMA incremental_vacuum({int(config.CLEANUP_VACUUM_PAGES)})")
+    except Exception as e:
+        logger.error(f"Error during cleanup of old movies: {e}")
+    finally:
+        _release(conn)
     logger.info(f"Deleted {deleted_count} old movies from the database.")
+    return deleted_count
 
-def get_movies_for_search(query_text: str, limit: int = 5) -> list:
-    """Searches for movies by title or description."""
-    conn = sqlite3.connect('movies.db')
-    c = conn.cursor()
+_SEARCH_OVERFETCH = 4 # Rows fetched per requested result, so enough distinct works remain after collapsing copies
+
+def _search_movies_like(c: sqlite3.Cursor, query_text: str, limit: int) -> list:
+    """Unindexed search (scans movies) for when the full-text index cannot answer the query."""
     search_pattern = f"%{query_text}%"
     c.execute("""
-        SELECT title, url, source, image_url, category, description, release_year, average_rating
+        SELECT title, url, source, image_url, category, description, release_year, average_rating, work_id
         FROM movies
         WHERE title LIKE ? OR description LIKE ? OR genres LIKE ?
         ORDER BY last_updated DESC
         LIMIT ?
     """, (search_pattern, search_pattern, search_pattern, limit)) # Added genres to search
-    results = c.fetchall()
-    conn.close()
-    return results
+    return c.fetchall()
+
+def get_movies_for_search(query_text: str, limit: int = 5) -> list:
+    """
+    Searches for movies by title, description or genres. Both the stored text and the query are
+    Arabic-normalized, so spelling variants match. Titles starting with the query come first
+    (a range scan on idx_movies_title_key), then full-text matches ranked by relevance; a query whose words
+    are all too short for the trigram index is matched with LIKE instead.
+    Copies of the same work on different sources are collapsed into one result: each row is
+    (title, url, source, image_url, category, description, release_year, average_rating, sources)
+    where sources lists (source, url) for every stored copy.
+    """
+    search_key = make_search_key(query_text)
+    match_query = _fts_match_query(query_text)
+    if not search_key:
+        return []
+    fetch_limit = limit * _SEARCH_OVERFETCH
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("""
+        SELECT title, url, source, image_url, category, description, release_year, average_rating, work_id
+        FROM movies
+        WHERE title_key >= ? AND title_key < ?
+        ORDER BY title_key = ? DESC, last_updated DESC
+        LIMIT ?
+    """, (search_key, search_key + "\U0010ffff", search_key, fetch_limit))
+    rows = c.fetchall()
+
+    if len({row[8] for row in rows}) < limit:
+        if not match_query: # Only words shorter than a trigram
+            rows += _search_movies_like(c, query_text, fetch_limit)
+        else:
+            try:
+                c.execute(f"""
+                    SELECT m.title, m.url, m.source, m.image_url, m.category, m.description, m.release_year, m.average_rating, m.work_id
+                    FROM movies_fts
+                    JOIN movies m ON m.id = movies_fts.rowid
+                    WHERE movies_fts MATCH ?
+                    ORDER BY bm25(movies_fts, {", ".join(map(str, _FTS_COLUMN_WEIGHTS))}), m.last_updated DESC
+                    LIMIT ?
+                """, (match_query, fetch_limit))
+                rows += c.fetchall()
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Full-text search unavailable, falling back to LIKE search: {e}")
+                rows = _search_movies_like(c, query_text, fetch_limit)
+
+    # One result per work (a movie not yet linked to a work stands alone)
+    results = []
+    seen_works = set()
+    for row in rows:
+        work = row[8] if row[8] is not None else ("url", row[1])
+        if work in seen_works:
+            continue
+        seen_works.add(work)
+        results.append(row)
+        if len(results) >= limit:
+            break
+    work_sources = _get_work_sources(c, [row[8] for row in results if row[8] is not None])
+    _release(conn)
+    return [row[:8] + (work_sources.get(row[8], [(row[2], row[1])]),) for row in results]
 
-def get_all_users_with_preferences() -> list:
-    """Retrieves all users with their notification preferences."""
-    conn = sqlite3.connect('movies.db')
+def search_movies_page(query_text: str, cursor: str = None, page_size: int = 5) -> tuple[list, str | None]:
+    """
+    One page of full-text search results, newest first, keyset-paginated on (last_updated, id).
+    Each work appears once (its newest matching copy), on exactly one page. Rows have the same shape
+    as get_movies_for_search. Returns (rows, next_cursor); next_cursor is None on the last page.
+    Words shorter than a trigram are ignored, so a query made only of those has no results.
+    Unlike the other paginated queries this is not a range scan: FTS5 returns the whole match set in
+    rowid order, and copies are collapsed (ROW_NUMBER per work) before the cursor applies, so every
+    page costs O(matches). Applying the cursor first would bring back works whose newest copy was on
+    an earlier page; a query matching tens of thousands of movies needs a narrower search instead.
+    """
+    match_query = _fts_match_query(query_text)
+    if not match_query:
+        return [], None
+    after = _decode_cursor(cursor)
+    keyset_sql = "AND (last_updated, id) < (?, ?)" if after else ""
+    conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT user_id, receive_movies, receive_series, receive_anime FROM users")
+    try:
+        c.execute(f"""
+            WITH matches AS (
+                SELECT m.id, m.last_updated, m.title, m.url, m.source, m.image_url, m.category, m.description,
+                       m.release_year, m.average_rating, m.work_id,
+                       ROW_NUMBER() OVER (PARTITION BY COALESCE(m.work_id, -m.id) ORDER BY m.last_updated DESC, m.id DESC) AS copy_rank
+                FROM movies_fts
+                JOIN movies m ON m.id = movies_fts.rowid
+                WHERE movies_fts MATCH ?
+            )
+            SELECT id, last_updated, title, url, source, image_url, category, description, release_year, average_rating, work_id
+            FROM matches
+            WHERE copy_rank = 1 {keyset_sql}
+            ORDER BY last_updated DESC, id DESC
+            LIMIT ?
+        """, (match_query, *(after or ()), page_size + 1))
+        rows = c.fetchall()
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Full-text search unavailable, paginated search disabled: {e}")
+        _release(conn)
+        return [], None
+    next_cursor = _encode_cursor(rows[page_size - 1][1], rows[page_size - 1][0]) if len(rows) > page_size else None
+    rows = rows[:page_size]
+    work_sources = _get_work_sources(c, [row[10] for row in rows if row[10] is not None])
+    _release(conn)
+    return [row[2:10] + (work_sources.get(row[10], [(row[4], row[3])]),) for row in rows], next_cursor
+
+def group_movies_by_work(movies: list, new_since: datetime = None) -> list:
+    """
+    Collapses movie dicts (e.g. a round's newly added movies) to one per work, keeping the first copy
+    and adding "work_id" and "sources" ([(source, url), ...] for every stored copy of the work).
+    With new_since, movies whose work already existed before that time are dropped, so a release
+    that merely appeared on one more source is not announced again.
+    """
+    if not movies:
+        return []
+    conn = get_connection()
+    c = conn.cursor()
+    work_by_url = {}
+    unique_urls = list({movie["url"] for movie in movies})
+    for i in range(0, len(unique_urls), 500):
+        chunk = unique_urls[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        c.execute(f"""SELECT m.url, w.id, w.created_at FROM movies m JOIN works w ON w.id = m.work_id
+                      WHERE m.url IN ({placeholders})""", chunk)
+        work_by_url.update((url, (work_id, created_at)) for url, work_id, created_at in c.fetchall())
+    new_since_str = new_since.strftime('%Y-%m-%d %H:%M:%S.%f') if new_since else None
+
+    grouped = []
+    seen_works = set()
+    for movie in movies:
+        work_id, created_at = work_by_url.get(movie["url"], (None, None))
+        if work_id is None:
+            grouped.append({**movie, "work_id": None, "sources": [(movie["source"], movie["url"])]})
+            continue
+        if work_id in seen_works or (new_since_str and created_at < new_since_str):
+            continue
+        seen_works.add(work_id)
+        grouped.append({**movie, "work_id": work_id})
+    work_sources = _get_work_sources(c, list(seen_works))
+    _release(conn)
+    for movie in grouped:
+        if movie["work_id"] is not None:
+            movie["sources"] = work_sources.get(movie["work_id"], [(movie["source"], movie["url"])])
+    return grouped
+
+SCRAPE_ROUNDS_KEPT = 500 # Older scrape round records are deleted
+
+def get_catalogue_counts() -> dict:
+    """Returns the number of stored movies and registered users (trigger-maintained counters, no table scan)."""
+    conn = get_connection()
+    counts = dict(conn.execute("SELECT name, value FROM stats WHERE name IN ('movies', 'users')").fetchall())
+    _release(conn)
+    return {"movies": counts.get("movies", 0), "users": counts.get("users", 0)}
+
+def record_scrape_round(entry_point: str, started_at: datetime, finished_at: datetime, items_processed: int,
+                        new_movies: int, sites_ok: int, sites_failed: int):
+    """Logs the timing and item counts of a finished scrape round, keeping the last SCRAPE_ROUNDS_KEPT rounds."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("""
+        INSERT INTO scrape_rounds (entry_point, started_at, finished_at, duration_seconds, items_processed, new_movies, sites_ok, sites_failed)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (entry_point, started_at.strftime('%Y-%m-%d %H:%M:%S'), finished_at.strftime('%Y-%m-%d %H:%M:%S'),
+          round((finished_at - started_at).total_seconds(), 2), items_processed, new_movies, sites_ok, sites_failed))
+    c.execute("DELETE FROM scrape_rounds WHERE id <= ?", (c.lastrowid - SCRAPE_ROUNDS_KEPT,))
+    conn.commit()
+    _release(conn)
+
+def get_bot_stats() -> dict:
+    """
+    Everything /alive shows, read from the stats counters and the latest scrape_rounds row:
+    {"movies", "users", "last_round"}; last_round is None before the first round, otherwise a dict
+    with entry_point, started_at, finished_at (datetimes), duration_seconds, items_processed,
+    new_movies, sites_ok and sites_failed.
+    """
+    stats = get_catalogue_counts()
+    conn = get_connection()
+    row = conn.execute("""
+        SELECT entry_point, started_at, finished_at, duration_seconds, items_processed, new_movies, sites_ok, sites_failed
+        FROM scrape_rounds ORDER BY id DESC LIMIT 1
+    """).fetchone()
+    _release(conn)
+    stats["last_round"] = None
+    if row:
+        stats["last_round"] = {
+            "entry_point": row[0],
+            "started_at": datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S'),
+            "finished_at": datetime.strptime(row[2], '%Y-%m-%d %H:%M:%S'),
+            "duration_seconds": row[3],
+            "items_processed": row[4],
+            "new_movies": row[5],
+            "sites_ok": row[6],
+            "sites_failed": row[7],
+        }
+    return stats
+
+# Notification preference flag of each movie category; uncategorized items are routed as movies.
+# The single category -> preference rule; bot.py derives its digest routing from it
+PREFERENCE_COLUMNS = ("receive_movies", "receive_series", "receive_anime") # Order of the flags get_all_users_with_preferences returns
+PREFERENCE_COLUMNS_BY_CATEGORY = {"فيلم": "receive_movies", "مسلسل": "receive_series", "أنمي": "receive_anime"}
+
+def preference_column_for_category(category: str) -> str:
+    """The users column that opts in to a category; uncategorized items count as movies (deduce_category's default)."""
+    return PREFERENCE_COLUMNS_BY_CATEGORY.get(category, "receive_movies")
+
+def get_all_users_with_preferences(categories: set = None) -> list:
+    """
+    Retrieves all active users with their notification preferences.
+    With categories, only users who receive at least one of those categories are returned,
+    so users with nothing to be notified about are not even loaded.
+    """
+    query = f"SELECT user_id, {', '.join(PREFERENCE_COLUMNS)} FROM users WHERE is_active = 1"
+    if categories is not None:
+        columns = sorted({preference_column_for_category(category) for category in categories})
+        if not columns:
+            return []
+        query += " AND (" + " OR ".join(columns) + ")"
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(query)
     users_with_prefs = c.fetchall()
-    conn.close()
+    _release(conn)
     return users_with_prefs
 
-def upsert_movie(movie_data: dict) -> bool:
-    """Inserts or updates a movie record in the database. Returns True if newly added, False if updated/exists."""
-    conn = sqlite3.connect('movies.db')
+def deactivate_users(user_ids: list) -> int:
+    """
+    Marks users whose chat blocked the bot or no longer exists as inactive, so broadcasts skip them
+    until they send /start again, and closes their still pending notifications. Returns the number deactivated.
+    """
+    if not user_ids:
+        return 0
+    now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_connection()
     c = conn.cursor()
-    current_time_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    c.executemany("UPDATE users SET is_active = 0, deactivated_at = ? WHERE user_id = ? AND is_active = 1",
+                  [(now_str, user_id) for user_id in user_ids])
+    deactivated_count = c.rowcount
+    c.executemany("UPDATE outbox SET state = 'blocked', updated_at = ? WHERE user_id = ? AND state = 'pending'",
+                  [(now_str, user_id) for user_id in user_ids])
+    conn.commit()
+    _release(conn)
+    logger.info(f"Deactivated {deactivated_count} users whose chats are blocked or gone.")
+    return deactivated_count
 
-    c.execute("SELECT id, title, image_url, category, description, release_year, genres FROM movies WHERE url = ?", (movie_data["url"],))
-    existing_movie_db = c.fetchone()
+def _select_stored_urls(c: sqlite3.Cursor, urls: list) -> set:
+    """Returns which of the given (unique) URLs exist in movies, using the caller's cursor/transaction."""
+    stored_urls = set()
+    for i in range(0, len(urls), 500): # Stay well below SQLite's bound parameter limit
+        chunk = urls[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        c.execute(f"SELECT url FROM movies WHERE url IN ({placeholders})", chunk)
+        stored_urls.update(row[0] for row in c.fetchall())
+    return stored_urls
 
-    if existing_movie_db:
-        db_id, old_title, old_image_url, old_category, old_description, old_release_year, old_genres = existing_movie_db
+def upsert_movies_batch(movies: list, details_fetched: bool = True, announce: bool = False) -> set:
+    """
+    Inserts or updates a whole scrape round of movies in a single transaction.
+    Existing rows are only rewritten when one of their fields actually changed; every row gets
+    details_fetched_at stamped. With details_fetched=False (listing-only data, no detail page
+    visited) new rows are inserted with details_fetched_at NULL, so the scraper still fetches their
+    details, and existing rows are left untouched. With announce=True new rows are flagged
+    announce_pending in the same transaction, so their notification survives a restart until
+    enqueue_notifications takes it over. Returns the set of URLs that were newly added.
+    """
+    if not movies:
+        return set()
+    current_time_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    details_fetched_at = current_time_str if details_fetched else None
+    rows = [(movie_data["title"], make_search_key(movie_data["title"]), movie_data["url"], movie_data["source"], movie_data.get("image_url"),
+             movie_data.get("category"), movie_data.get("description"), movie_data.get("release_year"),
+             movie_data.get("genres"), current_time_str, details_fetched_at, 1 if announce else 0)
+            for movie_data in movies]
+    unique_urls = list({movie_data["url"] for movie_data in movies})
 
-        changed = False
-        if old_title != movie_data["title"]: changed = True
-        if old_image_url != movie_data.get("image_url"): changed = True
-        if old_category != movie_data.get("category"): changed = True
-        if old_description != movie_data.get("description"): changed = True
-        if old_release_year != movie_data.get("release_year"): changed = True
-        if old_genres != movie_data.get("genres"): changed = True # New: check genres
+    conn = get_connection()
+    c = conn.cursor()
+    try:
+        # Take the write lock before looking up which URLs exist, so a concurrent round (manual /update
+        # and the scheduled one) cannot see the same URL as absent and also report it as new
+        conn.execute("BEGIN IMMEDIATE")
+        existing_urls = _select_stored_urls(c, unique_urls)
 
-        if changed:
-            c.execute("""
-                UPDATE movies 
-                SET title = ?, image_url = ?, category = ?, description = ?, release_year = ?, genres = ?, last_updated = ?
-                WHERE url = ?
-            """, (movie_data["title"], movie_data.get("image_url"), movie_data.get("category"),
-                  movie_data.get("description"), movie_data.get("release_year"), movie_data.get("genres"), current_time_str, movie_data["url"]))
-            conn.commit()
-            logger.info(f"Updated movie: {movie_data['title']} from {movie_data['source']}")
-            return False # Not newly added
-    else:
-        c.execute("INSERT INTO movies (title, url, source, image_url, category, description, release_year, genres, last_updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                  (movie_data["title"], movie_data["url"], movie_data["source"], movie_data.get("image_url"),
-                   movie_data.get("category"), movie_data.get("description"), movie_data.get("release_year"), movie_data.get("genres"), current_time_str))
+        insert_sql = """
+            INSERT INTO movies (title, title_key, url, source, image_url, category, description, release_year, genres, last_updated,
+                                details_fetched_at, announce_pending)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+        if not details_fetched:
+            c.executemany(insert_sql + " ON CONFLICT(url) DO NOTHING", rows)
+            written_count = c.rowcount
+        else:
+            c.executemany(insert_sql + """
+            ON CONFLICT(url) DO UPDATE
+            SET work_id = CASE WHEN movies.title IS NOT excluded.title OR movies.category IS NOT excluded.category
+                                    OR movies.release_year IS NOT excluded.release_year THEN NULL ELSE movies.work_id END,
+                title = excluded.title, title_key = excluded.title_key, image_url = excluded.image_url, category = excluded.category,
+                description = excluded.description, release_year = excluded.release_year, genres = excluded.genres,
+                last_updated = excluded.last_updated
+            WHERE movies.title IS NOT excluded.title OR movies.title_key IS NOT excluded.title_key OR movies.image_url IS NOT excluded.image_url
+               OR movies.category IS NOT excluded.category OR movies.description IS NOT excluded.description
+               OR movies.release_year IS NOT excluded.release_year OR movies.genres IS NOT excluded.genres
+            """, rows)
+            written_count = c.rowcount
+            # Unchanged rows were left alone above; only record that their detail pages were checked
+            c.executemany("UPDATE movies SET details_fetched_at = ? WHERE url = ?",
+                          [(current_time_str, url) for url in existing_urls])
+        _assign_work_ids(c) # New rows and rows whose title/category/year changed
         conn.commit()
-        logger.info(f"Added new movie: {movie_data['title']} from {movie_data['source']}")
-        return True # Newly added
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        _release(conn)
 
-def add_movie_rating(movie_url: str, rating: int) -> bool:
+    new_urls = set(unique_urls) - existing_urls
+    logger.info(f"Saved {len(rows)} scraped movies in one transaction: {len(new_urls)} new, "
+                f"{max(written_count - len(new_urls), 0)} updated.")
+    return new_urls
+
+def update_site_statuses(statuses: dict):
     """
-    Adds a new rating for a movie and updates its average_rating and rating_count.
-    Returns True if successful, False otherwise.
+    Writes the coalesced status of every site scraped in a round in a single transaction.
+    statuses maps site_name -> (status, error_message).
     """
-    conn = sqlite3.connect('movies.db')
+    if not statuses:
+        return
+    current_time_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+    conn = get_connection()
     c = conn.cursor()
-    try:
-        c.execute("SELECT average_rating, rating_count FROM movies WHERE url = ?", (movie_url,))
-        result = c.fetchone()
+    c.executemany("INSERT OR REPLACE INTO site_status (site_name, last_scraped, status, last_error) VALUES (?, ?, ?, ?)",
+                  [(site_name, current_time_str, status, error_message) for site_name, (status, error_message) in statuses.items()])
+    conn.commit()
+    _release(conn)
 
-        if result:
-            current_avg_rating, current_rating_count = result
-            new_rating_count = current_rating_count + 1
-            new_total_sum = (current_avg_rating * current_rating_count) + rating
-            new_average_rating = new_total_sum / new_rating_count
+def get_fresh_movie_urls(urls: list, max_age_days: int) -> set:
+    """
+    Returns the subset of the given URLs that are already stored and whose detail page
+    was fetched within the last max_age_days. Looked up in batches of IN (...) queries.
+    """
+    if not urls:
+        return set()
+    conn = get_connection()
+    c = conn.cursor()
+    fresh_since = (datetime.now() - timedelta(days=max_age_days)).strftime('%Y-%m-%d %H:%M:%S')
+    unique_urls = list(set(urls))
+    fresh_urls = set()
+    for i in range(0, len(unique_urls), 500): # Stay well below SQLite's bound parameter limit
+        chunk = unique_urls[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        c.execute(f"SELECT url FROM movies WHERE url IN ({placeholders}) AND details_fetched_at >= ?",
+                  (*chunk, fresh_since))
+        fresh_urls.update(row[0] for row in c.fetchall())
+    _release(conn)
+    return fresh_urls
 
-            c.execute("""
-                UPDATE movies
-                SET average_rating = ?, rating_count = ?
-                WHERE url = ?
-            """, (new_average_rating, new_rating_count, movie_url))
-            conn.commit()
-            logger.info(f"Updated rating for {movie_url}: New avg={new_average_rating:.2f}, count={new_rating_count}")
-            return True
-        else:
+def get_stored_movie_urls(urls: list) -> set:
+    """Returns the subset of the given URLs that are already stored. Looked up in batches of IN (...) queries."""
+    if not urls:
+        return set()
+    conn = get_connection()
+    stored_urls = _select_stored_urls(conn.cursor(), list(set(urls)))
+    _release(conn)
+    return stored_urls
+
+def mark_details_fetched(urls: list) -> int:
+    """Records in one transaction that the detail pages of stored movies were checked. Returns the number of rows stamped."""
+    if not urls:
+        return 0
+    current_time_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_connection()
+    c = conn.cursor()
+    c.executemany("UPDATE movies SET details_fetched_at = ? WHERE url = ?", [(current_time_str, url) for url in urls])
+    conn.commit()
+    updated_count = c.rowcount
+    _release(conn)
+    return updated_count
+
+def add_movie_rating(user_id: int, movie_url: str, rating: int) -> bool:
+    """
+    Records a user's rating for a movie; rating the same movie again replaces the earlier vote.
+    The movie's average_rating and rating_count are updated by triggers in the same statement,
+    so concurrent ratings never overwrite each other.
+    Returns True if the rating was recorded, False if the movie does not exist or on error.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""
+            INSERT INTO ratings (user_id, movie_url, rating, rated_at)
+            SELECT ?, url, ?, ? FROM movies WHERE url = ?
+            ON CONFLICT(user_id, movie_url) DO UPDATE SET rating = excluded.rating, rated_at = excluded.rated_at
+        """, (user_id, rating, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), movie_url))
+        conn.commit()
+        if c.rowcount == 0:
             logger.warning(f"Attempted to rate non-existent movie: {movie_url}")
             return False
+        logger.info(f"User {user_id} rated {movie_url}: {rating}")
+        return True
     except Exception as e:
         logger.error(f"Error adding movie rating for {movie_url}: {e}")
         return False
     finally:
-        conn.close()
+        _release(conn)
+
+def get_user_rating(user_id: int, movie_url: str) -> int | None:
+    """Returns the rating a user gave a movie, or None if they have not rated it."""
+    conn = get_connection()
+    row = conn.execute("SELECT rating FROM ratings WHERE user_id = ? AND movie_url = ?", (user_id, movie_url)).fetchone()
+    _release(conn)
+    return row[0] if row else None
+
+def get_top_rated_movies(limit: int = 10, min_ratings: int = 1) -> list:
+    """
+    Returns the best rated movies as (title, url, source, image_url, category, average_rating, rating_count),
+    reading the trigger-maintained aggregates in index order (idx_movies_top_rated).
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("""
+        SELECT title, url, source, image_url, category, average_rating, rating_count
+        FROM movies
+        WHERE rating_count > 0 AND rating_count >= ?
+        ORDER BY average_rating DESC, rating_count DESC
+        LIMIT ?
+    """, (min_ratings, limit))
+    results = c.fetchall()
+    _release(conn)
+    return results
 
 def get_movie_by_url(url: str) -> dict | None:
     """Retrieves a single movie's details by its URL."""
-    conn = sqlite3.connect('movies.db')
+    conn = get_connection()
     c = conn.cursor()
     c.execute("""
         SELECT title, url, source, image_url, category, description, release_year, average_rating, rating_count, genres
@@ -308,7 +997,7 @@ def get_movie_by_url(url: str) -> dict | None:
         WHERE url = ?
     """, (url,))
     row = c.fetchone()
-    conn.close()
+    _release(conn)
     if row:
         return {
             "title": row[0],
@@ -326,7 +1015,7 @@ def get_movie_by_url(url: str) -> dict | None:
 
 def add_favorite(user_id: int, movie_url: str) -> bool:
     """Adds a movie to a user's favorites. Returns True if added, False if already exists."""
-    conn = sqlite3.connect('movies.db')
+    conn = get_connection()
     c = conn.cursor()
     try:
         c.execute("INSERT INTO favorites (user_id, movie_url) VALUES (?, ?)", (user_id, movie_url))
@@ -340,11 +1029,11 @@ def add_favorite(user_id: int, movie_url: str) -> bool:
         logger.error(f"Error adding favorite for user {user_id}, movie {movie_url}: {e}")
         return False
     finally:
-        conn.close()
+        _release(conn)
 
 def remove_favorite(user_id: int, movie_url: str) -> bool:
     """Removes a movie from a user's favorites. Returns True if removed, False if not found."""
-    conn = sqlite3.connect('movies.db')
+    conn = get_connection()
     c = conn.cursor()
     try:
         c.execute("DELETE FROM favorites WHERE user_id = ? AND movie_url = ?", (user_id, movie_url))
@@ -359,11 +1048,174 @@ def remove_favorite(user_id: int, movie_url: str) -> bool:
         logger.error(f"Error removing favorite for user {user_id}, movie {movie_url}: {e}")
         return False
     finally:
-        conn.close()
+        _release(conn)
+
+# --- Notification outbox ---
+# A broadcast is written here before anything is sent, and every batch's outcome is stored as soon
+# as it is known, so a restart resumes the remaining recipients instead of losing them.
+# States: 'pending' (to send), 'delivered', 'blocked' (chat gone) and 'failed' (out of attempts).
+
+def get_pending_announcements() -> tuple[list, list]:
+    """
+    Returns the movies flagged announce_pending as (works, urls): works are the movies collapsed to
+    one per release with their "sources" (see group_movies_by_work), leaving out releases that already
+    had an announced (or never announced) copy; urls are all flagged URLs, to clear in enqueue_notifications.
+    """
+    conn = get_connection()
+    rows = conn.execute("""
+        SELECT title, url, source, image_url, category, release_year,
+               NOT EXISTS (SELECT 1 FROM movies AS known WHERE known.work_id = movies.work_id AND known.announce_pending = 0) AS new_work
+        FROM movies WHERE announce_pending = 1 ORDER BY id
+    """).fetchall()
+    _release(conn)
+    movies = [{"title": title, "url": url, "source": source, "image_url": image_url, "category": category, "release_year": release_year}
+              for title, url, source, image_url, category, release_year, new_work in rows if new_work]
+    return group_movies_by_work(movies), [row[1] for row in rows]
+
+def enqueue_notifications(digests: list, announced_urls: list = ()) -> int:
+    """
+    Adds a broadcast to the outbox. digests is a list of ([text, ...], [user_id, ...]): each digest
+    is stored once and gets one pending row per recipient. The announce_pending flags of
+    announced_urls are cleared in the same transaction. Returns the number of rows added.
+    """
+    now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_connection()
+    c = conn.cursor()
+    added_count = 0
+    try:
+        for texts, user_ids in digests:
+            c.execute("INSERT INTO notification_payloads (texts, created_at) VALUES (?, ?)",
+                      (json.dumps(texts, ensure_ascii=False), now_str))
+            payload_id = c.lastrowid
+            c.executemany("INSERT INTO outbox (user_id, payload_id, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                          [(user_id, payload_id, now_str, now_str) for user_id in user_ids])
+            added_count += len(user_ids)
+        c.executemany("UPDATE movies SET announce_pending = 0 WHERE url = ?", [(url,) for url in announced_urls])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        _release(conn)
+    return added_count
+
+def get_pending_notifications(after_id: int = 0, limit: int = 500) -> list:
+    """
+    Pending outbox rows with an id above after_id, oldest first: [(outbox_id, user_id, [text, ...], parts_sent), ...].
+    parts_sent is the number of leading parts an earlier, interrupted attempt already delivered.
+    """
+    conn = get_connection()
+    rows = conn.execute("""
+        SELECT outbox.id, outbox.user_id, outbox.payload_id, notification_payloads.texts, outbox.parts_sent
+        FROM outbox JOIN notification_payloads ON notification_payloads.id = outbox.payload_id
+        WHERE outbox.state = 'pending' AND outbox.id > ?
+        ORDER BY outbox.id
+        LIMIT ?
+    """, (after_id, limit)).fetchall()
+    _release(conn)
+    payloads = {} # A batch shares a handful of digests; decode each once
+    for _, _, payload_id, texts_json, _ in rows:
+        if payload_id not in payloads:
+            payloads[payload_id] = json.loads(texts_json)
+    return [(outbox_id, user_id, payloads[payload_id], parts_sent) for outbox_id, user_id, payload_id, _, parts_sent in rows]
+
+def mark_notifications(outcomes: list):
+    """
+    Stores the outcome ("delivered", "blocked" or "failed") of sent outbox rows and how many of their
+    parts have been delivered so far: [(outbox_id, outcome, parts_sent), ...].
+    A failed row goes back to pending until it has used OUTBOX_MAX_ATTEMPTS attempts; its next attempt
+    starts after the parts already delivered.
+    """
+    now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_connection()
+    conn.executemany("""
+        UPDATE outbox SET attempts = attempts + 1, updated_at = ?4, parts_sent = MAX(parts_sent, ?5),
+                          state = CASE WHEN ?1 = 'failed' AND attempts + 1 < ?2 THEN 'pending' ELSE ?1 END
+        WHERE id = ?3
+    """, [(outcome, config.OUTBOX_MAX_ATTEMPTS, outbox_id, now_str, parts_sent) for outbox_id, outcome, parts_sent in outcomes])
+    conn.commit()
+    _release(conn)
+
+def prune_outbox() -> int:
+    """
+    Deletes finished notifications older than OUTBOX_RETENTION_DAYS in batches of CLEANUP_BATCH_SIZE,
+    then the digests no outbox row points at anymore. Returns the number of outbox rows deleted.
+    """
+    cutoff_str = (datetime.now() - timedelta(days=config.OUTBOX_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_connection()
+    c = conn.cursor()
+    deleted_count = 0
+    try:
+        while True:
+            # Ids grow with time, so the oldest finished rows are found at the front of the table
+            c.execute("""
+                DELETE FROM outbox WHERE id IN (
+                    SELECT id FROM outbox WHERE state != 'pending' AND updated_at < ? ORDER BY id LIMIT ?)
+            """, (cutoff_str, config.CLEANUP_BATCH_SIZE))
+            conn.commit()
+            deleted_count += c.rowcount
+            if c.rowcount < config.CLEANUP_BATCH_SIZE:
+                break
+            time.sleep(config.CLEANUP_BATCH_PAUSE_SECONDS)
+        c.execute("DELETE FROM notification_payloads WHERE NOT EXISTS (SELECT 1 FROM outbox WHERE outbox.payload_id = notification_payloads.id)")
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Error pruning the notification outbox: {e}")
+    finally:
+        _release(conn)
+    if deleted_count:
+        logger.info(f"Pruned {deleted_count} finished notifications from the outbox.")
+    return deleted_count
+
+# --- Keyset pagination ---
+# A cursor is the sort key of the last row on the previous page: "<timestamp as hex epoch>.<row id in hex>",
+# short enough for Telegram callback data (64 bytes). The next page seeks past it with a row-value
+# comparison, so every page is an index range scan no matter how deep it is (full-text search is the
+# exception, see search_movies_page).
+
+def _encode_cursor(timestamp_str: str, row_id: int) -> str:
+    """Encodes a ('%Y-%m-%d %H:%M:%S' timestamp, row id) sort key as a compact cursor."""
+    seconds = calendar.timegm(datetime.strptime(str(timestamp_str)[:19], '%Y-%m-%d %H:%M:%S').timetuple())
+    return f"{seconds:x}.{row_id:x}"
+
+def _decode_cursor(cursor: str | None) -> tuple[str, int] | None:
+    """Decodes a cursor back to its (timestamp string, row id); None or an invalid cursor means the first page."""
+    if not cursor:
+        return None
+    try:
+        seconds_hex, row_id_hex = cursor.split(".")
+        timestamp_str = datetime.fromtimestamp(int(seconds_hex, 16), timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        return timestamp_str, int(row_id_hex, 16)
+    except (ValueError, OverflowError, OSError):
+        logger.warning(f"Ignoring invalid pagination cursor: {cursor!r}")
+        return None
+
+def get_favorites_page(user_id: int, cursor: str = None, page_size: int = 10) -> tuple[list, str | None]:
+    """
+    One page of a user's favorites, newest first, keyset-paginated on (added_date, favorites rowid)
+    through idx_favorites_user_added. Rows have the same shape as get_favorites.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    after = _decode_cursor(cursor)
+    keyset_sql = "AND (f.added_date, f.rowid) < (?, ?)" if after else "" # Kept out of the SQL on page 1 so the index range applies
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f"""
+        SELECT f.rowid, f.added_date, m.title, m.url, m.source, m.image_url, m.category, m.description, m.release_year, m.average_rating, m.rating_count, m.genres
+        FROM favorites f
+        JOIN movies m ON f.movie_url = m.url
+        WHERE f.user_id = ? {keyset_sql}
+        ORDER BY f.added_date DESC, f.rowid DESC
+        LIMIT ?
+    """, (user_id, *(after or ()), page_size + 1))
+    rows = c.fetchall()
+    _release(conn)
+    next_cursor = _encode_cursor(rows[page_size - 1][1], rows[page_size - 1][0]) if len(rows) > page_size else None
+    return [row[2:] for row in rows[:page_size]], next_cursor
 
 def get_favorites(user_id: int) -> list:
     """Retrieves a list of favorite movies for a given user."""
-    conn = sqlite3.connect('movies.db')
+    conn = get_connection()
     c = conn.cursor()
     c.execute("""
         SELECT m.title, m.url, m.source, m.image_url, m.category, m.description, m.release_year, m.average_rating, m.rating_count, m.genres
@@ -373,5 +1225,5 @@ def get_favorites(user_id: int) -> list:
         ORDER BY f.added_date DESC
     """, (user_id,))
     results = c.fetchall()
-    conn.close()
+    _release(conn)
     return results
@@ -0,0 +1,135 @@
+import asyncio
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import aiohttp
+import config
+
+logger = logging.getLogger(__name__)
+
+# --- Persistent conditional-GET cache for scraped pages ---
+# Stores the body of every response that carried an ETag or Last-Modified validator,
+# so the next request can be sent with If-None-Match / If-Modified-Since.
+# The total body size is bounded by HTTP_CACHE_MAX_BYTES; least recently used entries are evicted first.
+
+# All cache I/O runs on one dedicated thread that keeps a single connection open, so the event loop
+# shared by the detail workers never waits on SQLite. The total body size is tracked in memory
+# (summed once when the connection is opened), so storing a page does not scan the table.
+_cache_executor = None
+_conn = None # Only used on the cache thread
+_total_size = 0
+
+def _get_cache_executor() -> ThreadPoolExecutor:
+    """Returns the cache thread's executor, starting it on first use."""
+    global _cache_executor
+    if _cache_executor is None:
+        _cache_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="http-cache")
+    return _cache_executor
+
+async def _run_on_cache_thread(func, *args):
+    """Runs a cache function on the cache thread and awaits its result."""
+    return await asyncio.get_running_loop().run_in_executor(_get_cache_executor(), func, *args)
+
+def _connect() -> sqlite3.Connection:
+    """Returns the cache thread's connection, opening it (and creating the table) on first use."""
+    global _conn, _total_size
+    if _conn is None:
+        _conn = sqlite3.connect(config.HTTP_CACHE_DB_PATH)
+        _conn.execute('''CREATE TABLE IF NOT EXISTS http_cache
+                         (url TEXT PRIMARY KEY,
+                          etag TEXT,
+                          last_modified TEXT,
+                          body TEXT NOT NULL,
+                          size INTEGER NOT NULL,
+                          last_access TIMESTAMP NOT NULL)''')
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_http_cache_last_access ON http_cache (last_access)")
+        _conn.commit()
+        _total_size = _conn.execute("SELECT COALESCE(SUM(size), 0) FROM http_cache").fetchone()[0]
+    return _conn
+
+def get_cached_response(url: str) -> dict | None:
+    """Returns the cached validators and body for a URL, or None if it is not cached."""
+    row = _connect().execute("SELECT etag, last_modified, body FROM http_cache WHERE url = ?", (url,)).fetchone()
+    if row:
+        return {"etag": row[0], "last_modified": row[1], "body": row[2]}
+    return None
+
+def touch_cached_response(url: str):
+    """Marks a cached entry as recently used so it is evicted last."""
+    conn = _connect()
+    conn.execute("UPDATE http_cache SET last_access = ? WHERE url = ?", (datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f'), url))
+    conn.commit()
+
+def store_response(url: str, etag: str | None, last_modified: str | None, body: str):
+    """Stores (or replaces) a response and evicts least recently used entries above the size limit."""
+    global _total_size
+    size = len(body.encode('utf-8'))
+    if size > config.HTTP_CACHE_MAX_BYTES:
+        return # Would evict everything else; not worth caching
+    conn = _connect()
+    replaced = conn.execute("SELECT size FROM http_cache WHERE url = ?", (url,)).fetchone()
+    conn.execute("INSERT OR REPLACE INTO http_cache (url, etag, last_modified, body, size, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                 (url, etag, last_modified, body, size, datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')))
+    _total_size += size - (replaced[0] if replaced else 0)
+    _evict_if_needed(conn)
+    conn.commit()
+
+def _evict_if_needed(conn: sqlite3.Connection):
+    """Deletes least recently used entries until the total body size fits HTTP_CACHE_MAX_BYTES."""
+    global _total_size
+    if _total_size <= config.HTTP_CACHE_MAX_BYTES:
+        return
+    evicted_urls = []
+    for url, size in conn.execute("SELECT url, size FROM http_cache ORDER BY last_access ASC"):
+        if _total_size <= config.HTTP_CACHE_MAX_BYTES:
+            break
+        evicted_urls.append((url,))
+        _total_size -= size
+    conn.executemany("DELETE FROM http_cache WHERE url = ?", evicted_urls)
+    logger.info(f"HTTP cache: evicted {len(evicted_urls)} least recently used entries.")
+
+def _close_connection():
+    global _conn
+    if _conn is not None:
+        _conn.close()
+        _conn = None
+
+async def close_http_cache():
+    """Closes the cache connection and stops the cache thread (see scrapers.close_scraper_resources)."""
+    global _cache_executor
+    if _cache_executor is not None:
+        await _run_on_cache_thread(_close_connection)
+        _cache_executor.shutdown(wait=True)
+        _cache_executor = None
+
+async def fetch_with_cache(session: aiohttp.ClientSession, url: str, headers: dict = None,
+                           timeout: aiohttp.ClientTimeout = None) -> tuple[str, bool, str]:
+    """
+    GETs a URL as a conditional request when a cached copy exists.
+    Returns (content, not_modified, final_url). On a 304 the cached body is returned with not_modified=True,
+    so callers can skip parsing a page that has not changed. final_url is the URL after redirects.
+    Raises aiohttp.ClientResponseError for error statuses, like response.raise_for_status().
+    """
+    cached = await _run_on_cache_thread(get_cached_response, url)
+    request_headers = dict(headers or {})
+    if cached:
+        if cached["etag"]:
+            request_headers['If-None-Match'] = cached["etag"]
+        if cached["last_modified"]:
+            request_headers['If-Modified-Since'] = cached["last_modified"]
+
+    request_kwargs = {"timeout": timeout} if timeout is not None else {} # Fall back to the session's default budget
+    async with session.get(url, headers=request_headers, **request_kwargs) as response:
+        if response.status == 304 and cached:
+            await _run_on_cache_thread(touch_cached_response, url)
+            return cached["body"], True, str(response.url)
+        response.raise_for_status()
+        content = await response.text()
+        final_url = str(response.url)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+
+    if etag or last_modified:
+        await _run_on_cache_thread(store_response, url, etag, last_modified, content)
+    return content, False, final_url
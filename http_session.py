@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+import aiohttp
+import config
+
+logger = logging.getLogger(__name__)
+
+# --- Shared HTTP session settings for the scraping subsystem ---
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36',
+    'Accept-Language': 'ar,en;q=0.8',
+}
+
+# Timeout budgets: connecting (incl. DNS/TLS) and waiting between reads are bounded separately,
+# so a slow host fails fast on connect while a large page still has time to stream in.
+LISTING_PAGE_TIMEOUT = aiohttp.ClientTimeout(
+    total=config.HTTP_LISTING_TIMEOUT_SECONDS,
+    connect=config.HTTP_CONNECT_TIMEOUT_SECONDS,
+    sock_read=config.HTTP_READ_TIMEOUT_SECONDS,
+)
+DETAIL_PAGE_TIMEOUT = aiohttp.ClientTimeout(
+    total=config.HTTP_DETAIL_TIMEOUT_SECONDS,
+    connect=config.HTTP_CONNECT_TIMEOUT_SECONDS,
+    sock_read=config.HTTP_READ_TIMEOUT_SECONDS,
+)
+
+# Long-lived sessions reused across rounds (only when HTTP_REUSE_SESSION is enabled).
+# A session is bound to the event loop it was created on, so each loop that scrapes keeps its own
+# instead of one loop replacing (and orphaning) another's; close_shared_session closes the current loop's.
+_shared_sessions = {} # event loop -> its long-lived session
+
+def create_scraper_session() -> aiohttp.ClientSession:
+    """
+    Creates a ClientSession with a tuned TCPConnector: bounded total and per-host connections,
+    cached DNS lookups and keep-alive reuse of idle connections.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=config.HTTP_CONNECTION_LIMIT,
+        limit_per_host=config.HTTP_CONNECTION_LIMIT_PER_HOST,
+        use_dns_cache=True,
+        ttl_dns_cache=config.HTTP_DNS_CACHE_SECONDS,
+        keepalive_timeout=config.HTTP_KEEPALIVE_SECONDS,
+        enable_cleanup_closed=True,
+    )
+    return aiohttp.ClientSession(connector=connector, headers=DEFAULT_HEADERS, timeout=DETAIL_PAGE_TIMEOUT)
+
+@asynccontextmanager
+async def scraper_session():
+    """
+    Yields the session to use for one scraping round.
+    With HTTP_REUSE_SESSION the long-lived session is returned and kept open afterwards,
+    so connection setup is paid once per event loop; otherwise a fresh session is closed on exit.
+    """
+    if not config.HTTP_REUSE_SESSION:
+        async with create_scraper_session() as session:
+            yield session
+        return
+
+    _forget_closed_loops()
+    loop = asyncio.get_running_loop()
+    session = _shared_sessions.get(loop)
+    if session is None or session.closed:
+        session = _shared_sessions[loop] = create_scraper_session()
+    yield session
+
+def _forget_closed_loops():
+    """Drops the sessions of loops that were closed without close_shared_session (their connections died with the loop)."""
+    for loop in [loop for loop in _shared_sessions if loop.is_closed()]:
+        if not _shared_sessions.pop(loop).closed:
+            logger.warning("An event loop was closed with its scraper session still open; await close_shared_session() before closing it.")
+
+async def close_shared_session():
+    """Closes the current event loop's long-lived scraper session, if one is open."""
+    session = _shared_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+    _forget_closed_loops()
@@ -1,76 +1,235 @@
 import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import aiohttp
 from bs4 import BeautifulSoup
+import lxml.html
 import re
 import logging
-from utils import clean_title, deduce_category, validate_url_async
-from db_manager import upsert_movie, update_site_status
+from datetime import datetime
+from utils import clean_title, clean_description, deduce_category, is_redirected_to_site_root
+from db_manager import upsert_movies_batch, update_site_statuses, group_movies_by_work, mark_details_fetched
+import db_async
+from http_cache import fetch_with_cache, close_http_cache
+from http_session import scraper_session, close_shared_session, LISTING_PAGE_TIMEOUT, DETAIL_PAGE_TIMEOUT
 import config # New: Import configuration settings
-from datetime import datetime, timedelta
+from urllib.parse import urlparse
 
 logger = logging.getLogger(__name__)
 
-# --- In-memory cache for scraped main pages ---
-# Stores {url: {'content': '...', 'timestamp': datetime.now()}}
-_scrape_cache = {}
+class InvalidMovieURLError(Exception):
+    """Raised when the detail page GET shows that a listing item no longer points to a valid page."""
 
 # --- List of all supported scraping sites ---
+# "parse_roots" lists the elements ("tag", "tag.class", "tag#id", "tag[attr]", "tag[attr=value]" or
+# "tag[attr*=value]") that contain everything the site's parser selects, including the ancestors its
+# selectors rely on. Only those subtrees are turned into a BeautifulSoup tree.
 SCRAPERS = [
-    {"name": "Wecima", "url": "https://wecima.video", "parser": "parse_wecima", "category_hint": "mixed"},
-    {"name": "TopCinema", "url": "https://web6.topcinema.cam/recent/", "parser": "parse_topcinema", "category_hint": "mixed"},
-    {"name": "CimaClub", "url": "https://cimaclub.day", "parser": "parse_cimaclub", "category_hint": "mixed"},
-    {"name": "TukTukCima", "url": "https://tuktukcima.art/recent/", "parser": "parse_tuktukcima", "category_hint": "mixed"},
-    {"name": "EgyBest", "url": "https://egy.onl/recent/", "parser": "parse_egy_onl", "category_hint": "mixed"}, 
-    {"name": "MyCima", "url": "https://mycima.video", "parser": "parse_mycima", "category_hint": "mixed"},
+    {"name": "Wecima", "url": "https://wecima.video", "parser": "wecima", "parse_roots": ("div.GridItem",), "category_hint": "mixed"},
+    {"name": "TopCinema", "url": "https://web6.topcinema.cam/recent/", "parser": "topcinema", "parse_roots": ("div.MovieBlock",), "category_hint": "mixed"},
+    {"name": "CimaClub", "url": "https://cimaclub.day", "parser": "cimaclub", "parse_roots": ("div.Small--Box",), "category_hint": "mixed"},
+    {"name": "TukTukCima", "url": "https://tuktukcima.art/recent/", "parser": "tuktukcima", "parse_roots": ("div.Blocks",), "category_hint": "mixed"},
+    {"name": "EgyBest", "url": "https://egy.onl/recent/", "parser": "egy_onl", "parse_roots": ("div.Blocks",), "category_hint": "mixed"}, 
+    {"name": "MyCima", "url": "https://mycima.video", "parser": "mycima", "parse_roots": ("div.GridItem",), "category_hint": "mixed"},
     
     # Akoam
-    {"name": "Akoam_Movies", "url": "https://akw.onl/movies/", "parser": "parse_akoam", "category_hint": "فيلم"},
-    {"name": "Akoam_Series", "url": "https://akw.onl/series/", "parser": "parse_akoam", "category_hint": "مسلسل"},
-    {"name": "Akoam_TV", "url": "https://akw.onl/tv/", "parser": "parse_akoam", "category_hint": "مسلسل"}, # Assuming TV is mostly series
+    {"name": "Akoam_Movies", "url": "https://akw.onl/movies/", "parser": "akoam", "parse_roots": ("div.movie-box",), "category_hint": "فيلم"},
+    {"name": "Akoam_Series", "url": "https://akw.onl/series/", "parser": "akoam", "parse_roots": ("div.movie-box",), "category_hint": "مسلسل"},
+    {"name": "Akoam_TV", "url": "https://akw.onl/tv/", "parser": "akoam", "parse_roots": ("div.movie-box",), "category_hint": "مسلسل"}, # Assuming TV is mostly series
 
     # Shahid4u
-    {"name": "Shahid4u_Movies", "url": "https://shahed4uapp.com/page/movies/", "parser": "parse_shahid4u", "category_hint": "فيلم"},
-    {"name": "Shahid4u_Series", "url": "https://shahed4uapp.com/page/series/", "parser": "parse_shahid4u", "category_hint": "مسلسل"},
+    {"name": "Shahid4u_Movies", "url": "https://shahed4uapp.com/page/movies/", "parser": "shahid4u", "parse_roots": ("div.GridItem",), "category_hint": "فيلم"},
+    {"name": "Shahid4u_Series", "url": "https://shahed4uapp.com/page/series/", "parser": "shahid4u", "parse_roots": ("div.GridItem",), "category_hint": "مسلسل"},
 
     # Aflamco
-    {"name": "Aflamco_Movies", "url": "https://aflamco.cloud/%D8%A7%D9%81%D9%84%D8%A7%D9%85/", "parser": "parse_aflamco", "category_hint": "فيلم"},
+    {"name": "Aflamco_Movies", "url": "https://aflamco.cloud/%D8%A7%D9%81%D9%84%D8%A7%D9%85/", "parser": "aflamco", "parse_roots": ("div.ModuleItem",), "category_hint": "فيلم"},
 
     # Cima4u (new domain and specific categories)
-    {"name": "Cima4u_Movies", "url": "https://cema4u.vip/category/%d8%a7%d9%81%d9%84%d8%a7%d9%81-%d8%a7%d8%ac%d9%86%d8%a8%d9%8a/", "parser": "parse_cima4u", "category_hint": "فيلم"},
-    {"name": "Cima4u_Series", "url": "https://cema4u.vip/category/%d9%85%d8%b3%d9%84%d8%b3%d9%84%d8%a7%d8%aa-%d8%a7%d8%ac%d9%86%d8%a8%d9%8a/", "parser": "parse_cima4u", "category_hint": "مسلسل"},
+    {"name": "Cima4u_Movies", "url": "https://cema4u.vip/category/%d8%a7%d9%81%d9%84%d8%a7%d9%81-%d8%a7%d8%ac%d9%86%d8%a8%d9%8a/", "parser": "cima4u", "parse_roots": ("div.MovieBlock",), "category_hint": "فيلم"},
+    {"name": "Cima4u_Series", "url": "https://cema4u.vip/category/%d9%85%d8%b3%d9%84%d8%b3%d9%84%d8%a7%d8%aa-%d8%a7%d8%ac%d9%86%d8%a8%d9%8a/", "parser": "cima4u", "parse_roots": ("div.MovieBlock",), "category_hint": "مسلسل"},
 
-    {"name": "Fushaar", "url": "https://www.fushaar.com/?tlvaz", "parser": "parse_fushaar", "category_hint": "mixed"},
+    {"name": "Fushaar", "url": "https://www.fushaar.com/?tlvaz", "parser": "fushaar", "parse_roots": ("div.Blocks",), "category_hint": "mixed"},
 
     # Aflaam
-    {"name": "Aflaam_Movies", "url": "https://aflaam.com/movies", "parser": "parse_aflaam", "category_hint": "فيلم"},
-    {"name": "Aflaam_Series", "url": "https://aflaam.com/series", "parser": "parse_aflaam", "category_hint": "مسلسل"},
+    {"name": "Aflaam_Movies", "url": "https://aflaam.com/movies", "parser": "aflaam", "parse_roots": ("div.movies-list-grid",), "category_hint": "فيلم"},
+    {"name": "Aflaam_Series", "url": "https://aflaam.com/series", "parser": "aflaam", "parse_roots": ("div.movies-list-grid",), "category_hint": "مسلسل"},
 
     # New Site: EgyDead
-    {"name": "EgyDead_Movies", "url": "https://egydead.video/category/%d8%a7%d9%81%d9%84%d8%a7%d9%81-%d8%a7%d8%ac%d9%86%d8%a8%d9%8a/", "parser": "parse_egydead", "category_hint": "فيلم"},
-    {"name": "EgyDead_Series", "url": "https://egydead.video/series-category/%d9%85%d8%b3%d9%84%d8%b3%d9%84%d8%a7%d8%aa-%d8%a7%d8%ac%d9%86%d8%a8%d9%8a-1/", "parser": "parse_egydead", "category_hint": "مسلسل"},
+    {"name": "EgyDead_Movies", "url": "https://egydead.video/category/%d8%a7%d9%81%d9%84%d8%a7%d9%81-%d8%a7%d8%ac%d9%86%d8%a8%d9%8a/", "parser": "egydead", "parse_roots": ("div.movie-box", "div.GridItem"), "category_hint": "فيلم"},
+    {"name": "EgyDead_Series", "url": "https://egydead.video/series-category/%d9%85%d8%b3%d9%84%d8%b3%d9%84%d8%a7%d8%aa-%d8%a7%d8%ac%d9%86%d8%a8%d9%8a-1/", "parser": "egydead", "parse_roots": ("div.movie-box", "div.GridItem"), "category_hint": "مسلسل"},
 ]
 
+# --- Detail page selectors and patterns (built once at import) ---
+_DESCRIPTION_SELECTORS = (
+    "div.story", "div.Description", "div.single-text", "div#plot",
+    "p.movie-description", "div.entry-content p", "div.BlockItemFull p",
+    "div.post-story p", "div.MovieContent__Details__Story",
+    "div.MovieInfo__Details__Story" # Added for Shahid4u like sites
+)
+_GENRE_SELECTORS = (
+    "a[href*='genre']", # Common for genre links
+    "div.MovieInfo__Details__item strong:contains('النوع') + span a", # Example for Shahid4u
+    "div.info-list a[href*='genre']", # Another common pattern
+    "div.category-list a" # Generic category list
+)
+# Everything parse_movie_details looks at: the meta description, description containers,
+# year containers and genre links/lists.
+_DETAIL_PARSE_ROOTS = (
+    "meta[name=description]",
+    "div.story", "div.Description", "div.single-text", "div#plot", "p.movie-description",
+    "div.entry-content", "div.BlockItemFull", "div.post-story",
+    "div.MovieContent__Details__Story", "div.MovieInfo__Details__Story",
+    "span.year", "div.MovieInfo__Details__item",
+    "a[href*=genre]", "div.info-list", "div.category-list",
+)
+_YEAR_LABEL_RE = re.compile(r"سنة الإصدار|Year")
+_YEAR_RE = re.compile(r'(\d{4})')
+
+# --- Partial parsing ---
+_SIMPLE_SELECTOR_RE = re.compile(r'^(\w+)((?:\.[\w-]+|#[\w-]+|\[[\w-]+(?:\*?=[^\]]+)?\])*)$')
+_SELECTOR_PART_RE = re.compile(r'\.([\w-]+)|#([\w-]+)|\[([\w-]+)(?:(\*?=)([^\]]+))?\]')
+
+def _selector_to_xpath(selector: str) -> str:
+    """Converts a simple selector from parse_roots (see SCRAPERS) into an XPath expression."""
+    match = _SIMPLE_SELECTOR_RE.match(selector)
+    if not match:
+        raise ValueError(f"Unsupported parse root selector: {selector}")
+    tag, parts = match.groups()
+    conditions = []
+    for class_name, element_id, attr, operator, value in _SELECTOR_PART_RE.findall(parts):
+        if class_name:
+            conditions.append(f"contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')")
+        elif element_id:
+            conditions.append(f"@id='{element_id}'")
+        elif operator == '*=':
+            conditions.append(f"contains(@{attr}, '{value}')")
+        elif operator == '=':
+            conditions.append(f"@{attr}='{value}'")
+        else:
+            conditions.append(f"@{attr}")
+    return f"//{tag}" + "".join(f"[{condition}]" for condition in conditions)
+
+_parse_roots_xpath_cache = {}
+
+def partial_soup(content: str, parse_roots: tuple, source_for_logging: str = "") -> BeautifulSoup:
+    """
+    Builds a BeautifulSoup tree containing only the outermost elements matching parse_roots.
+    The page is first parsed by lxml (a fast, compact C tree); only the needed subtrees are then
+    converted into BeautifulSoup objects, which is where most parse time and memory go.
+    Falls back to parsing the whole page if the partial parse fails.
+    """
+    try:
+        xpath = _parse_roots_xpath_cache.get(parse_roots)
+        if xpath is None:
+            xpath = _parse_roots_xpath_cache[parse_roots] = " | ".join(_selector_to_xpath(root) for root in parse_roots)
+
+        document = lxml.html.document_fromstring(content)
+        matches = document.xpath(xpath) # Document order
+        matched = set(matches)
+        fragments = [
+            lxml.html.tostring(element, encoding='unicode', with_tail=False)
+            for element in matches
+            if not any(ancestor in matched for ancestor in element.iterancestors()) # Keep outermost only
+        ]
+        return BeautifulSoup("".join(fragments), 'lxml')
+    except Exception as e:
+        logger.warning(f"Partial parse failed for {source_for_logging}, parsing the whole page: {e}")
+        try:
+            return BeautifulSoup(content, 'lxml')
+        except Exception as bs_e:
+            logger.warning(f"LXML parser not available for {source_for_logging}, falling back to html.parser: {bs_e}")
+            return BeautifulSoup(content, 'html.parser')
+
+# --- Parse executor ---
+# HTML parsing is CPU-bound, so it runs in a pool (see PARSE_EXECUTOR in config) instead of on the
+# event loop. Jobs are module-level functions taking and returning plain, picklable data.
+# Worker processes are started by a forkserver (spawn where that is unavailable): forking this
+# already multi-threaded process (DB, cache and scheduler threads) could copy a held lock and deadlock.
+_parse_executor = None
+
+def _default_parse_workers() -> int:
+    """One worker per core this process may run on (os.cpu_count() counts every core of the host)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+def get_parse_executor():
+    """Returns the shared parse executor, creating it on first use (None when PARSE_EXECUTOR is "inline")."""
+    global _parse_executor
+    if _parse_executor is None and config.PARSE_EXECUTOR != "inline":
+        max_workers = config.PARSE_WORKERS or _default_parse_workers()
+        if config.PARSE_EXECUTOR == "process":
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _parse_executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(start_method))
+        else:
+            _parse_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="parser")
+        logger.info(f"Started {config.PARSE_EXECUTOR} parse executor with {max_workers} workers.")
+    return _parse_executor
+
+def shutdown_parse_executor():
+    """Shuts the parse executor down (it is started again on next use)."""
+    global _parse_executor
+    if _parse_executor is not None:
+        _parse_executor.shutdown(wait=False, cancel_futures=True)
+        _parse_executor = None
+
+async def close_scraper_resources():
+    """
+    Releases what the scraping pipeline keeps open between rounds: the current event loop's shared
+    HTTP session, the HTTP cache thread and its connection, and the parse executor.
+    Awaited on shutdown, on the loop that ran the rounds, before that loop is closed.
+    """
+    await close_shared_session()
+    await close_http_cache()
+    shutdown_parse_executor()
+
+async def run_parse_job(func, *args):
+    """Runs a parse function in the parse executor and awaits its result."""
+    executor = get_parse_executor()
+    if executor is None:
+        return func(*args)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool next time and parse inline now
+        logger.error("Parse process pool is broken, restarting it.")
+        shutdown_parse_executor()
+        return func(*args)
+
 # --- Helper function to extract detailed movie info using AIOHTTP ---
-async def extract_detailed_movie_info_async(session: aiohttp.ClientSession, movie_url: str, movie_title_for_ref: str = "") -> (str, int | None, str):
+async def extract_detailed_movie_info_async(session: aiohttp.ClientSession, movie_url: str, movie_title_for_ref: str = "") -> dict | None:
     """
-    Extracts detailed description, release year, and genres from a movie's detail page.
+    Fetches a movie's detail page through the HTTP cache and extracts its details.
+    The GET itself validates the item: an error status or a redirect to the site's home page
+    raises InvalidMovieURLError. Network errors are raised as aiohttp/asyncio errors.
+    Returns None if the page is unchanged since the last visit (304) and the movie is already stored;
+    the caller records the check with the rest of the round's writes.
+    """
+    try:
+        content, not_modified, final_url = await fetch_with_cache(session, movie_url, timeout=DETAIL_PAGE_TIMEOUT)
+    except aiohttp.ClientResponseError as e:
+        raise InvalidMovieURLError(f"HTTP {e.status} for {movie_url}") from e
+
+    if is_redirected_to_site_root(movie_url, final_url):
+        raise InvalidMovieURLError(f"{movie_url} redirected to {final_url}")
+
+    if not_modified and await db_async.get_stored_movie_urls([movie_url]):
+        logger.debug(f"Detail page unchanged, skipping parse: {movie_url}")
+        return None
+    return await run_parse_job(parse_movie_details, content, movie_url, movie_title_for_ref)
+
+def parse_movie_details(content: str, movie_url: str = "", movie_title_for_ref: str = "") -> dict:
+    """
+    Extracts detailed description, release year, and genres from a movie's detail page HTML.
+    Returns {"description": str, "release_year": int | None, "genres": str}.
     """
     description = ""
     release_year = None
     genres = "" # New: to store comma-separated genres
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
-        }
-        async with session.get(movie_url, headers=headers, timeout=30) as response:
-            response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-            content = await response.text()
-        
-        try:
-            movie_soup = BeautifulSoup(content, 'lxml')
-        except Exception as bs_e:
-            logger.warning(f"LXML parser not available for {movie_url}, falling back to html.parser: {bs_e}")
-            movie_soup = BeautifulSoup(content, 'html.parser')
+        movie_soup = partial_soup(content, _DETAIL_PARSE_ROOTS, movie_url)
 
         # 1. Try to get description from meta tag
         meta_description = movie_soup.find('meta', attrs={'name': 'description'})
@@ -81,12 +240,7 @@ async def extract_detailed_movie_info_async(session: aiohttp.ClientSession, movi
         
         # 2. If meta tag failed, try common description selectors
         if not description:
-            for selector in [
-                "div.story", "div.Description", "div.single-text", "div#plot",
-                "p.movie-description", "div.entry-content p", "div.BlockItemFull p",
-                "div.post-story p", "div.MovieContent__Details__Story",
-                "div.MovieInfo__Details__Story" # Added for Shahid4u like sites
-            ]:
+            for selector in _DESCRIPTION_SELECTORS:
                 tag = movie_soup.select_one(selector)
                 if tag:
                     text = tag.get_text(separator=' ', strip=True) 
@@ -96,71 +250,20 @@ async def extract_detailed_movie_info_async(session: aiohttp.ClientSession, movi
         
         # 3. Clean the description from promotional phrases
         if description:
-            promo_phrases = [
-                r'مشاهدة وتحميل (فيلم|مسلسل|انمي)?\s*', r'مشاهدة (فيلم|مسلسل|انمي)?\s*',
-                r'تحميل مباشر\s*', r'تنزيل مباشر\s*', r'حصريا\s*', r'فقط\s*',
-                r'اون لاين\s*', r'مباشرة\s*', r'روابط سريعة\s*',
-                r'بجودة\s*(?:HD|FHD|4K|720p|1080p|BluRay|WEB-DL|HDRip|DVDRip|BDRip|WEBRip)?\s*',
-                r'كامل ومترجم\s*', r'مترجم للعربية\s*', r'مدبلج\s*',
-                r'بدون إعلانات\s*', r'شاهد مجانا\s*', r'مجاناً\s*',
-                r'جميع حلقات\s*', r'الموسم (?:الاول|الثاني|الثالث|الرابع|الخامس|السادس|السابع|الثامن|التاسع|العاشر|الأول|الثاني|الثالث|الرابع|الخامس|السادس|السابع|الثامن|التاسع|العاشر|\d+)\s*',
-                r'ايجي بست\s*', r'وي سيما\s*', r'ماي سيما\s*', r'سيما كلوب\s*',
-                r'تكتوك سيما\s*', r'اكوام\s*', r'شاهد فور يو\s*', r'افلامكو\s*',
-                r'سيما فور يو\s*', r'فوشار\s*', r'افلام\s*', r'موقع [أ-ي\w\s]*?\s*', 
-                r'قصة (فيلم|مسلسل|انمي)\s*(?:جديد)?\s*(?:تدور احداث)?\s*(?:حول)?\s*', 
-                r'تدور احداث (الفيلم|المسلسل|الانمي)?\s*(?:حول)?\s*',
-                r'احداث (الفيلم|المسلسل|الانمي)?\s*(?:حول)?\s*',
-                r'ملخص القصة\s*(?:حول)?\s*',
-                r'تبدأ الاحداث عندما\s*',
-                r'فيلم (جديد|حصري|الأن)?\s*', r'مسلسل (جديد|حصري|الأن)?\s*', r'انمي (جديد|حصري|الأن)?\s*',
-                r'أفلام202[0-9]|مسلسلات202[0-9]|أنمي202[0-9]', 
-                r'اونلاين'
-            ]
-            
-            for phrase in promo_phrases:
-                description = re.sub(phrase, '', description, flags=re.IGNORECASE | re.DOTALL).strip()
-            
-            description = re.sub(r'^[^\w\s\u0600-\u06FF]+', '', description).strip()
-            description = re.sub(r'[^\w\s\u0600-\u06FF]+$', '', description).strip()
-
-            if movie_title_for_ref and description.lower().startswith(movie_title_for_ref.lower()):
-                description = description[len(movie_title_for_ref):].strip()
-                description = re.sub(r'^[^\w\s\u0600-\u06FF]+', '', description).strip() 
-
-            description = re.sub(r'\s{2,}', ' ', description).strip()
-            
-            if len(description) > 500: 
-                description = description[:497] + "..." 
+            description = clean_description(description, movie_title_for_ref)
 
         # Extract release year from the detail page
         year_tag = movie_soup.find("span", class_="year") # Example for Shahid4u
         if not year_tag:
-            year_tag = movie_soup.find("div", class_="MovieInfo__Details__item", string=re.compile(r"سنة الإصدار|Year")) # Generic search
-            if year_tag:
-                year_match = re.search(r'(\d{4})', year_tag.get_text(strip=True))
-                if year_match:
-                    try:
-                        release_year = int(year_match.group(1))
-                    except ValueError:
-                        release_year = None
-        
-        if year_tag and not release_year: # If year_tag exists but regex didn't catch it
-            year_match = re.search(r'(\d{4})', year_tag.get_text(strip=True))
+            year_tag = movie_soup.find("div", class_="MovieInfo__Details__item", string=_YEAR_LABEL_RE) # Generic search
+        if year_tag:
+            year_match = _YEAR_RE.search(year_tag.get_text(strip=True))
             if year_match:
-                try:
-                    release_year = int(year_match.group(1))
-                except ValueError:
-                    release_year = None
+                release_year = int(year_match.group(1))
 
         # Extract genres (new)
-        genre_selectors = [
-            "a[href*='genre']", # Common for genre links
-            "div.MovieInfo__Details__item strong:contains('النوع') + span a", # Example for Shahid4u
-            "div.info-list a[href*='genre']", # Another common pattern
-            "div.category-list a" # Generic category list
-        ]
         extracted_genres = []
-        for selector in genre_selectors:
+        for selector in _GENRE_SELECTORS:
             genre_tags = movie_soup.select(selector)
             for tag in genre_tags:
                 genre_text = tag.get_text(strip=True)
@@ -172,585 +275,368 @@ async def extract_detailed_movie_info_async(session: aiohttp.ClientSession, movi
         if extracted_genres:
             genres = ", ".join(sorted(list(set(extracted_genres)))) # Unique and sorted
 
-    except aiohttp.ClientError as e:
-        logger.warning(f"⚠️ Error fetching movie details from {movie_url} using aiohttp: {e}")
     except Exception as e:
-        logger.warning(f"⚠️ Unexpected error fetching movie details from {movie_url}: {e}")
+        logger.warning(f"⚠️ Unexpected error parsing movie details from {movie_url}: {e}")
     
-    return description, release_year, genres
-
-
-# --- Parser Functions for each site ---
-# (These functions remain largely the same, but now return raw_title for better detail extraction)
-
-def parse_wecima(soup):
-    movies = []
-    for item in soup.select("div.GridItem"):
-        try:
-            link_tag = item.select_one("a")
-            if not link_tag or not link_tag.get("href"):
-                logger.debug(f"Wecima: Skipping item due to missing link or href: {item.prettify()}")
-                continue
-            link = link_tag["href"]
-            
-            title_tag = item.select_one("strong.hasyear") or item.select_one("img")
-            raw_title = ""
-            if title_tag:
-                if title_tag.name == 'strong':
-                    raw_title = title_tag.get_text(strip=True)
-                else: # It's an img tag
-                    raw_title = title_tag.get("alt", "N/A")
-            if not raw_title or raw_title == "N/A":
-                logger.debug(f"Wecima: Title not found or N/A for link {link} - Item HTML: {item.prettify()}")
-                raw_title = "عنوان غير متوفر" # Provide a default title
-
-            image_url = None
-            bg_style_tag = item.select_one("span.BG--GridItem")
-            if bg_style_tag and 'data-lazy-style' in bg_style_tag.attrs:
-                match = re.search(r'url\((.*?)\)', bg_style_tag['data-lazy-style'])
-                if match:
-                    image_url = match.group(1).strip("'\"")
-            
-            if not image_url:
-                img_tag = item.select_one("img")
-                if img_tag:
-                    image_url = img_tag.get("data-src") or img_tag.get("src")
-            if not image_url:
-                logger.debug(f"Wecima: Image URL not found for title '{raw_title}' (link: {link}) - Item HTML: {item.prettify()}")
-                image_url = "https://placehold.co/200x300/cccccc/333333?text=No+Image" # Placeholder
-
-            movies.append({"title": raw_title, "url": link, "image_url": image_url, "source": "Wecima"})
-        except Exception as e:
-            logger.error(f"❌ Error parsing Wecima item: {e} - Item HTML causing error: {item.prettify()}")
-            continue
-    return movies
-
-def parse_topcinema(soup):
-    movies = []
-    for item in soup.select("div.col-lg-2.col-md-3.col-sm-4.col-xs-6.col-6.MovieBlock"):
-        try:
-            link_tag = item.select_one("a")
-            if not link_tag or not link_tag.get("href"):
-                logger.debug(f"TopCinema: Skipping item due to missing link or href: {item.prettify()}")
-                continue
-            link = link_tag["href"]
-            
-            title_tag = item.select_one("h2.Title")
-            raw_title = title_tag.get_text(strip=True) if title_tag else "N/A"
-            if not raw_title or raw_title == "N/A":
-                logger.debug(f"TopCinema: Title not found or N/A for link {link} - Item HTML: {item.prettify()}")
-                raw_title = "عنوان غير متوفر"
-            
-            img_tag = item.select_one("img")
-            image_url = img_tag.get("data-src") or img_tag.get("src") if img_tag else None
-            if not image_url:
-                logger.debug(f"TopCinema: Image URL not found for title '{raw_title}' (link: {link}) - Item HTML: {item.prettify()}")
-                image_url = "https://placehold.co/200x300/cccccc/333333?text=No+Image"
-            
-            movies.append({"title": raw_title, "url": link, "image_url": image_url, "source": "TopCinema"})
-        except Exception as e:
-            logger.error(f"❌ Error parsing TopCinema item: {e} - Item HTML causing error: {item.prettify()}")
-            continue
-    return movies
-
-def parse_cimaclub(soup):
-    movies = []
-    for item in soup.select("div.Small--Box"):
-        try:
-            link_tag = item.select_one("a.recent--block")
-            if not link_tag or not link_tag.get("href"):
-                logger.debug(f"CimaClub: Skipping item due to missing link or href: {item.prettify()}")
-                continue
-            link = link_tag["href"]
-            
-            raw_title = "عنوان غير متوفر" # Default value
-            
-            # Attempt 1: Get title from h2 within inner--title
-            title_h2_tag = item.select_one(".inner--title h2")
-            if title_h2_tag:
-                extracted_title = title_h2_tag.get_text(strip=True)
-                if extracted_title:
-                    raw_title = extracted_title
-            
-            # Attempt 2: If h2 failed, try img alt attribute
-            if raw_title == "عنوان غير متوفر":
-                img_tag_for_title = item.select_one("div.Poster img")
-                if img_tag_for_title:
-                    extracted_title = img_tag_for_title.get("alt", "")
-                    if extracted_title:
-                        raw_title = extracted_title
-            
-            # Attempt 3: If img alt failed, try link title attribute
-            if raw_title == "عنوان غير متوفر":
-                extracted_title = link_tag.get("title", "")
-                if extracted_title:
-                    raw_title = extracted_title
-
-            if raw_title == "عنوان غير متوفر":
-                logger.debug(f"CimaClub: Could not extract title for link {link} - Item HTML: {item.prettify()}")
-                raw_title = "عنوان غير متوفر" # Ensure default if all attempts fail
-
-            img_tag = item.select_one("div.Poster img")
-            image_url = img_tag.get("data-src") or img_tag.get("src") if img_tag else None
-            if not image_url:
-                logger.debug(f"CimaClub: Image URL not found for title '{raw_title}' (link: {link}) - Item HTML: {item.prettify()}")
-                image_url = "https://placehold.co/200x300/cccccc/333333?text=No+Image" # Placeholder
-            
-            movies.append({"title": raw_title, "url": link, "image_url": image_url, "source": "CimaClub"})
-        except Exception as e:
-            logger.error(f"❌ Error parsing CimaClub item: {e} - Item HTML causing error: {item.prettify()}")
-            continue
-    return movies
-
-def parse_tuktukcima(soup):
-    movies = []
-    for item in soup.select("div.Blocks ul li.MovieBlock"):
-        try:
-            link_tag = item.select_one("a")
-            if not link_tag or not link_tag.get("href"):
-                logger.debug(f"TukTukCima: Skipping item due to missing link or href: {item.prettify()}")
-                continue
-            link = link_tag["href"]
-            
-            title_tag = item.select_one("h2.Title")
-            raw_title = title_tag.get_text(strip=True) if title_tag else "N/A"
-            if not raw_title or raw_title == "N/A":
-                logger.debug(f"TukTukCima: Title not found or N/A for link {link} - Item HTML: {item.prettify()}")
-                raw_title = "عنوان غير متوفر"
-            
-            img_tag = item.select_one("img")
-            image_url = img_tag.get("data-src") or img_tag.get("src") if img_tag else None
-            if not image_url:
-                logger.debug(f"TukTukCima: Image URL not found for title '{raw_title}' (link: {link}) - Item HTML: {item.prettify()}")
-                image_url = "https://placehold.co/200x300/cccccc/333333?text=No+Image"
-            
-            movies.append({"title": raw_title, "url": link, "image_url": image_url, "source": "TukTukCima"})
-        except Exception as e:
-            logger.error(f"❌ Error parsing TukTukCima item: {e} - Item HTML causing error: {item.prettify()}")
-            continue
-    return movies
-
-def parse_egy_onl(soup):
+    return {"description": description, "release_year": release_year, "genres": genres}
+
+
+# --- Declarative listing parsers ---
+# Every site is a spec run by extract_listing_items():
+#   "items":  selector for one listing item
+#   "link":   selector for the item's anchor (items without an href are skipped)
+#   "title":  candidates (selector, attribute) - attribute None means the element's text,
+#             selector None means the link element itself
+#   "title_mode": "first_found" uses the first candidate whose element exists (an empty value or
+#             "N/A" then falls back to the default title); "first_nonempty" tries candidates until
+#             one yields a non-empty value
+#   "image":  candidates (selector, attribute) or (selector, attribute, regex); the first non-empty
+#             value wins, a regex extracts its first group (stripped of quotes)
+_CSS_URL_RE = re.compile(r'url\((.*?)\)')
+_DEFAULT_TITLE = "عنوان غير متوفر"
+_PLACEHOLDER_IMAGE = "https://placehold.co/200x300/cccccc/333333?text=No+Image"
+_IMG_SRC = (("img", "data-src"), ("img", "src"))
+_GRID_ITEM_IMAGE = (("span.BG--GridItem", "data-lazy-style", _CSS_URL_RE),) + _IMG_SRC
+
+SITE_PARSERS = {
+    "wecima": {"source": "Wecima", "items": "div.GridItem", "link": "a",
+               "title": (("strong.hasyear", None), ("img", "alt")), "image": _GRID_ITEM_IMAGE},
+    "topcinema": {"source": "TopCinema", "items": "div.col-lg-2.col-md-3.col-sm-4.col-xs-6.col-6.MovieBlock", "link": "a",
+                  "title": (("h2.Title", None),), "image": _IMG_SRC},
+    "cimaclub": {"source": "CimaClub", "items": "div.Small--Box", "link": "a.recent--block",
+                 "title": ((".inner--title h2", None), ("div.Poster img", "alt"), (None, "title")), "title_mode": "first_nonempty",
+                 "image": (("div.Poster img", "data-src"), ("div.Poster img", "src"))},
+    "tuktukcima": {"source": "TukTukCima", "items": "div.Blocks ul li.MovieBlock", "link": "a",
+                   "title": (("h2.Title", None),), "image": _IMG_SRC},
+    "egy_onl": {"source": "EgyBest", "items": "div.Blocks ul.MovieList div.movie-box", "link": "a",
+                "title": (("img", "alt"),), "image": _IMG_SRC},
+    "mycima": {"source": "MyCima", "items": "div.GridItem", "link": "a",
+               "title": (("strong.hasyear", None), ("img", "alt")), "image": _GRID_ITEM_IMAGE},
+    "akoam": {"source": "Akoam", "items": "div.movie-box", "link": "a",
+              "title": (("h2.Title", None), ("img", "alt")), "image": _IMG_SRC},
+    "shahid4u": {"source": "Shahid4u", "items": "div.GridItem", "link": "a.MovieBlock",
+                 "title": (("h2.MovieTitle", None),), "image": (("img", "src"),)}, # Shahid4u uses src directly
+    "aflamco": {"source": "Aflamco", "items": "div.ModuleItem", "link": "a",
+                "title": (("h2.ModuleTitle", None),), "image": _IMG_SRC},
+    "cima4u": {"source": "Cima4u", "items": "div.MovieBlock", "link": "a",
+               "title": (("h2.Title", None),), "image": _IMG_SRC},
+    "fushaar": {"source": "Fushaar", "items": "div.Blocks .MovieBlock", "link": "a",
+                "title": (("h2.Title", None),), "image": (("img", "data-lazy-src"), ("img", "src"))},
+    "aflaam": {"source": "Aflaam", "items": "div.movies-list-grid div.item", "link": "a.box",
+               "title": (("h3.entry-title", None),), "image": (("picture img.lazy", "data-src"), ("picture img.lazy", "src"))},
+    "egydead": {"source": "EgyDead", "items": "div.movie-box, div.GridItem, div.Blocks ul.MovieList div.movie-box", "link": "a",
+                "title": (("h2.Title", None), ("strong.hasyear", None), ("img", "alt")), "image": _IMG_SRC},
+}
+
+def _candidate_value(element, attribute):
+    """Reads an element's stripped text (attribute None) or an attribute value."""
+    if attribute is None:
+        return element.get_text(strip=True)
+    return element.get(attribute)
+
+def extract_listing_items(soup, spec: dict) -> list:
+    """
+    Extracts {"title", "url", "image_url", "source"} dicts from a listing page according to a SITE_PARSERS spec.
+    Logging only uses the link and title, never the item's HTML, so nothing is serialized in the loop.
+    """
+    source = spec["source"]
+    title_candidates = spec["title"]
+    first_nonempty = spec.get("title_mode") == "first_nonempty"
+    image_candidates = spec["image"]
     movies = []
-    for item in soup.select("div.Blocks ul.MovieList div.movie-box"):
+    for item in soup.select(spec["items"]):
         try:
-            link_tag = item.select_one("a")
+            link_tag = item.select_one(spec["link"])
             if not link_tag or not link_tag.get("href"):
-                logger.debug(f"EgyBest: Skipping item due to missing link or href: {item.prettify()}")
+                logger.debug("%s: Skipping item due to missing link or href", source)
                 continue
             link = link_tag["href"]
-            
-            # Title is in img alt attribute
-            title_tag = item.select_one("img")
-            raw_title = title_tag.get("alt", "N/A") if title_tag else "N/A"
-            if not raw_title or raw_title == "N/A":
-                logger.debug(f"EgyBest: Title not found or N/A for link {link} - Item HTML: {item.prettify()}")
-                raw_title = "عنوان غير متوفر"
-            
-            image_url = title_tag.get("data-src") or title_tag.get("src") if title_tag else None
-            if not image_url:
-                logger.debug(f"EgyBest: Image URL not found for title '{raw_title}' (link: {link}) - Item HTML: {item.prettify()}")
-                image_url = "https://placehold.co/200x300/cccccc/333333?text=No+Image"
-            
-            movies.append({"title": raw_title, "url": link, "image_url": image_url, "source": "EgyBest"})
-        except Exception as e:
-            logger.error(f"❌ Error parsing EgyBest item: {e} - Item HTML causing error: {item.prettify()}")
-            continue
-    return movies
 
+            found = {} # selector -> element (or None), so each selector runs once per item
+            def find(selector):
+                if selector is None:
+                    return link_tag
+                if selector not in found:
+                    found[selector] = item.select_one(selector)
+                return found[selector]
 
-def parse_mycima(soup):
-    movies = []
-    for item in soup.select("div.GridItem"):
-        try:
-            link_tag = item.select_one("a")
-            if not link_tag or not link_tag.get("href"):
-                logger.debug(f"MyCima: Skipping item due to missing link or href: {item.prettify()}")
-                continue
-            link = link_tag["href"]
-            
-            title_tag = item.select_one("strong.hasyear") or item.select_one("img")
             raw_title = ""
-            if title_tag:
-                if title_tag.name == 'strong':
-                    raw_title = title_tag.get_text(strip=True)
-                else: # It's an img tag
-                    raw_title = title_tag.get("alt", "N/A")
-            if not raw_title or raw_title == "N/A":
-                logger.debug(f"MyCima: Title not found or N/A for link {link} - Item HTML: {item.prettify()}")
-                raw_title = "عنوان غير متوفر"
+            for selector, attribute in title_candidates:
+                element = find(selector)
+                if element is None:
+                    continue
+                raw_title = _candidate_value(element, attribute) or ""
+                if raw_title or not first_nonempty:
+                    break
+            if not raw_title or (raw_title == "N/A" and not first_nonempty):
+                logger.debug("%s: Title not found for link %s", source, link)
+                raw_title = _DEFAULT_TITLE
 
             image_url = None
-            bg_style_tag = item.select_one("span.BG--GridItem")
-            if bg_style_tag and 'data-lazy-style' in bg_style_tag.attrs:
-                match = re.search(r'url\((.*?)\)', bg_style_tag['data-lazy-style'])
-                if match:
-                    image_url = match.group(1).strip("'\"")
-            
-            if not image_url:
-                img_tag = item.select_one("img")
-                if img_tag:
-                    image_url = img_tag.get("data-src") or img_tag.get("src")
-            if not image_url:
-                logger.debug(f"MyCima: Image URL not found for title '{raw_title}' (link: {link}) - Item HTML: {item.prettify()}")
-                image_url = "https://placehold.co/200x300/cccccc/333333?text=No+Image"
-
-            movies.append({"title": raw_title, "url": link, "image_url": image_url, "source": "MyCima"})
-        except Exception as e:
-            logger.error(f"❌ Error parsing MyCima item: {e} - Item HTML causing error: {item.prettify()}")
-            continue
-    return movies
-
-def parse_akoam(soup):
-    movies = []
-    for item in soup.select("div.movie-box"):
-        try:
-            link_tag = item.select_one("a")
-            if not link_tag or not link_tag.get("href"):
-                logger.debug(f"Akoam: Skipping item due to missing link or href: {item.prettify()}")
-                continue
-            link = link_tag["href"]
-            
-            title_tag = item.select_one("h2.Title") or item.select_one("img") # Title can be in h2 or img alt
-            raw_title = ""
-            if title_tag:
-                if title_tag.name == 'h2':
-                    raw_title = title_tag.get_text(strip=True)
-                else: # It's an img tag
-                    raw_title = title_tag.get("alt", "N/A")
-            if not raw_title or raw_title == "N/A":
-                logger.debug(f"Akoam: Title not found or N/A for link {link} - Item HTML: {item.prettify()}")
-                raw_title = "عنوان غير متوفر"
-            
-            img_tag = item.select_one("img")
-            image_url = img_tag.get("data-src") or img_tag.get("src") if img_tag else None
-            if not image_url:
-                logger.debug(f"Akoam: Image URL not found for title '{raw_title}' (link: {link}) - Item HTML: {item.prettify()}")
-                image_url = "https://placehold.co/200x300/cccccc/333333?text=No+Image"
-            
-            movies.append({"title": raw_title, "url": link, "image_url": image_url, "source": "Akoam"})
-        except Exception as e:
-            logger.error(f"❌ Error parsing Akoam item: {e} - Item HTML causing error: {item.prettify()}")
-            continue
-    return movies
-
-def parse_shahid4u(soup):
-    movies = []
-    for item in soup.select("div.GridItem"):
-        try:
-            link_tag = item.select_one("a.MovieBlock") # Specific anchor tag
-            if not link_tag or not link_tag.get("href"):
-                logger.debug(f"Shahid4u: Skipping item due to missing link or href: {item.prettify()}")
-                continue
-            link = link_tag["href"]
-            
-            title_tag = item.select_one("h2.MovieTitle")
-            raw_title = title_tag.get_text(strip=True) if title_tag else "N/A"
-            if not raw_title or raw_title == "N/A":
-                logger.debug(f"Shahid4u: Title not found or N/A for link {link} - Item HTML: {item.prettify()}")
-                raw_title = "عنوان غير متوفر"
-            
-            img_tag = item.select_one("img")
-            image_url = img_tag.get("src") if img_tag else None # Shahid4u uses src directly
+            for selector, attribute, *pattern in image_candidates:
+                element = find(selector)
+                value = element.get(attribute) if element is not None else None
+                if value and pattern:
+                    match = pattern[0].search(value)
+                    value = match.group(1).strip("'\"") if match else None
+                if value:
+                    image_url = value
+                    break
             if not image_url:
-                logger.debug(f"Shahid4u: Image URL not found for title '{raw_title}' (link: {link}) - Item HTML: {item.prettify()}")
-                image_url = "https://placehold.co/200x300/cccccc/333333?text=No+Image"
-            
-            movies.append({"title": raw_title, "url": link, "image_url": image_url, "source": "Shahid4u"})
-        except Exception as e:
-            logger.error(f"❌ Error parsing Shahid4u item: {e} - Item HTML causing error: {item.prettify()}")
-            continue
-    return movies
+                logger.debug("%s: Image URL not found for title '%s' (link: %s)", source, raw_title, link)
+                image_url = _PLACEHOLDER_IMAGE
 
-def parse_aflamco(soup):
-    movies = []
-    for item in soup.select("div.ModuleItem"):
-        try:
-            link_tag = item.select_one("a")
-            if not link_tag or not link_tag.get("href"):
-                logger.debug(f"Aflamco: Skipping item due to missing link or href: {item.prettify()}")
-                continue
-            link = link_tag["href"]
-            
-            title_tag = item.select_one("h2.ModuleTitle")
-            raw_title = title_tag.get_text(strip=True) if title_tag else "N/A"
-            if not raw_title or raw_title == "N/A":
-                logger.debug(f"Aflamco: Title not found or N/A for link {link} - Item HTML: {item.prettify()}")
-                raw_title = "عنوان غير متوفر"
-            
-            img_tag = item.select_one("img")
-            image_url = img_tag.get("data-src") or img_tag.get("src") if img_tag else None
-            if not image_url:
-                logger.debug(f"Aflamco: Image URL not found for title '{raw_title}' (link: {link}) - Item HTML: {item.prettify()}")
-                image_url = "https://placehold.co/200x300/cccccc/333333?text=No+Image"
-            
-            movies.append({"title": raw_title, "url": link, "image_url": image_url, "source": "Aflamco"})
+            movies.append({"title": raw_title, "url": link, "image_url": image_url, "source": source})
         except Exception as e:
-            logger.error(f"❌ Error parsing Aflamco item: {e} - Item HTML causing error: {item.prettify()}")
+            logger.error(f"❌ Error parsing {source} item: {e}")
             continue
     return movies
 
-def parse_cima4u(soup):
-    movies = []
-    for item in soup.select("div.MovieBlock"):
-        try:
-            link_tag = item.select_one("a")
-            if not link_tag or not link_tag.get("href"):
-                logger.debug(f"Cima4u: Skipping item due to missing link or href: {item.prettify()}")
-                continue
-            link = link_tag["href"]
-            
-            title_tag = item.select_one("h2.Title")
-            raw_title = title_tag.get_text(strip=True) if title_tag else "N/A"
-            if not raw_title or raw_title == "N/A":
-                logger.debug(f"Cima4u: Title not found or N/A for link {link} - Item HTML: {item.prettify()}")
-                raw_title = "عنوان غير متوفر"
-            
-            img_tag = item.select_one("img")
-            image_url = img_tag.get("data-src") or img_tag.get("src") if img_tag else None
-            if not image_url:
-                logger.debug(f"Cima4u: Image URL not found for title '{raw_title}' (link: {link}) - Item HTML: {item.prettify()}")
-                image_url = "https://placehold.co/200x300/cccccc/333333?text=No+Image"
-            
-            movies.append({"title": raw_title, "url": link, "image_url": image_url, "source": "Cima4u"})
-        except Exception as e:
-            logger.error(f"❌ Error parsing Cima4u item: {e} - Item HTML causing error: {item.prettify()}")
-            continue
-    return movies
-
-def parse_fushaar(soup):
-    movies = []
-    for item in soup.select("div.Blocks .MovieBlock"):
-        try:
-            link_tag = item.select_one("a")
-            if not link_tag or not link_tag.get("href"):
-                logger.debug(f"Fushaar: Skipping item due to missing link or href: {item.prettify()}")
-                continue
-            link = link_tag["href"]
-            
-            title_tag = item.select_one("h2.Title")
-            raw_title = title_tag.get_text(strip=True) if title_tag else "N/A"
-            if not raw_title or raw_title == "N/A":
-                logger.debug(f"Fushaar: Title not found or N/A for link {link} - Item HTML: {item.prettify()}")
-                raw_title = "عنوان غير متوفر"
-            
-            img_tag = item.select_one("img")
-            image_url = img_tag.get("data-lazy-src") or img_tag.get("src") if img_tag else None
-            if not image_url:
-                logger.debug(f"Fushaar: Image URL not found for title '{raw_title}' (link: {link}) - Item HTML: {item.prettify()}")
-                image_url = "https://placehold.co/200x300/cccccc/333333?text=No+Image"
-            
-            movies.append({"title": raw_title, "url": link, "image_url": image_url, "source": "Fushaar"})
-        except Exception as e:
-            logger.error(f"❌ Error parsing Fushaar item: {e} - Item HTML causing error: {item.prettify()}")
-            continue
-    return movies
-
-def parse_aflaam(soup):
-    movies = []
-    for item in soup.select("div.movies-list-grid div.item"):
-        try:
-            link_tag = item.select_one("a.box")
-            if not link_tag or not link_tag.get("href"):
-                logger.debug(f"Aflaam: Skipping item due to missing link or href: {item.prettify()}")
-                continue
-            link = link_tag["href"]
-            
-            title_tag = item.select_one("h3.entry-title")
-            raw_title = title_tag.get_text(strip=True) if title_tag else "N/A"
-            if not raw_title or raw_title == "N/A":
-                logger.debug(f"Aflaam: Title not found or N/A for link {link} - Item HTML: {item.prettify()}")
-                raw_title = "عنوان غير متوفر"
-            
-            img_tag = item.select_one("picture img.lazy") 
-            image_url = img_tag.get("data-src") or img_tag.get("src") if img_tag else None
-            if not image_url:
-                logger.debug(f"Aflaam: Image URL not found for title '{raw_title}' (link: {link}) - Item HTML: {item.prettify()}")
-                image_url = "https://placehold.co/200x300/cccccc/333333?text=No+Image"
-            
-            movies.append({"title": raw_title, "url": link, "image_url": image_url, "source": "Aflaam"})
-        except Exception as e:
-            logger.error(f"❌ Error parsing Aflaam item: {e} - Item HTML causing error: {item.prettify()}")
-            continue
-    return movies
-
-def parse_egydead(soup):
-    movies = []
-    for item in soup.select("div.movie-box, div.GridItem, div.Blocks ul.MovieList div.movie-box"):
-        try:
-            link_tag = item.select_one("a")
-            if not link_tag or not link_tag.get("href"):
-                logger.debug(f"EgyDead: Skipping item due to missing link or href: {item.prettify()}")
-                continue
-            link = link_tag["href"]
-            
-            raw_title = "عنوان غير متوفر"
-            title_tag = item.select_one("h2.Title") or item.select_one("strong.hasyear") or item.select_one("img")
-            if title_tag:
-                if title_tag.name == 'img':
-                    raw_title = title_tag.get("alt", "N/A")
-                else:
-                    raw_title = title_tag.get_text(strip=True)
-            
-            if not raw_title or raw_title == "N/A":
-                logger.debug(f"EgyDead: Title not found or N/A for link {link} - Item HTML: {item.prettify()}")
-                raw_title = "عنوان غير متوفر"
-
-            image_url = None
-            img_tag = item.select_one("img")
-            if img_tag:
-                image_url = img_tag.get("data-src") or img_tag.get("src")
-            if not image_url:
-                logger.debug(f"EgyDead: Image URL not found for title '{raw_title}' (link: {link}) - Item HTML: {item.prettify()}")
-                image_url = "https://placehold.co/200x300/cccccc/333333?text=No+Image"
-            
-            movies.append({"title": raw_title, "url": link, "image_url": image_url, "source": "EgyDead"})
-        except Exception as e:
-            logger.error(f"❌ Error parsing EgyDead item: {e} - Item HTML causing error: {item.prettify()}")
-            continue
-    return movies
+def parse_listing_page(content: str, scraper_info: dict) -> list:
+    """
+    Parses a site's main page with the SITE_PARSERS spec named in its SCRAPERS entry.
+    Returns a list of dictionaries with initial movie data.
+    """
+    soup = partial_soup(content, scraper_info["parse_roots"], scraper_info["name"])
+    return extract_listing_items(soup, SITE_PARSERS[scraper_info["parser"]])
 
 
 # --- Main scraping logic ---
-async def scrape_single_main_page_and_parse(session: aiohttp.ClientSession, scraper_info: dict):
+def _record_site_status(site_statuses: dict, site_name: str, status: str, error_message: str = None):
+    """
+    Coalesces a site's status for the round (written once at the end by update_site_statuses):
+    once anything from the site succeeded it stays 'active', otherwise the latest error is kept.
+    """
+    if site_statuses.get(site_name, (None, None))[0] == 'active':
+        return
+    site_statuses[site_name] = (status, error_message)
+
+async def scrape_single_main_page_and_parse(session: aiohttp.ClientSession, scraper_info: dict, site_statuses: dict):
     """
     Fetches and parses the main page of a single site using aiohttp.
-    Uses in-memory cache to avoid redundant requests within the cache expiry time.
+    Goes through the persistent HTTP cache: a page that is unchanged since the last round (304)
+    is not downloaded again but its cached copy is still parsed, because items a previous round
+    failed to save must be retried (the fresh-URL pre-pass skips the ones already stored).
     Returns a list of dictionaries with initial movie data.
     """
     site_name = scraper_info["name"]
     site_url = scraper_info["url"]
-    parser_func_name = scraper_info["parser"]
-    
-    # Check cache first
-    if site_url in _scrape_cache:
-        cached_data = _scrape_cache[site_url]
-        if datetime.now() - cached_data['timestamp'] < timedelta(seconds=config.CACHE_EXPIRY_SECONDS):
-            logger.info(f"✅ Serving {site_name} main page from cache.")
-            return cached_data['movies']
-
-    # Get the parser function by name from the current module
-    parser_func = globals().get(parser_func_name)
-    if not parser_func:
-        logger.error(f"Parser function '{parser_func_name}' not found for {site_name}.")
-        update_site_status(site_name, 'failed', f"Parser function '{parser_func_name}' not found.")
+    parser_name = scraper_info["parser"]
+
+    # Check the parser spec exists before fetching anything
+    if parser_name not in SITE_PARSERS:
+        logger.error(f"Parser spec '{parser_name}' not found for {site_name}.")
+        _record_site_status(site_statuses, site_name, 'failed', f"Parser spec '{parser_name}' not found.")
         return []
 
     logger.info(f"Scanning main page for: {site_name} - {site_url}")
     
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
-        }
-        async with session.get(site_url, headers=headers, timeout=60) as response:
-            response.raise_for_status()
-            content = await response.text()
-        
-        try:
-            soup = BeautifulSoup(content, 'lxml') 
-        except Exception as bs_e:
-            logger.warning(f"LXML parser not available for {site_name}, falling back to html.parser: {bs_e}")
-            soup = BeautifulSoup(content, 'html.parser')
-        
-        movies = parser_func(soup)
+        content, not_modified, _ = await fetch_with_cache(session, site_url, timeout=LISTING_PAGE_TIMEOUT)
+        if not_modified:
+            logger.info(f"✅ {site_name} main page unchanged since last round, using the cached copy.")
+
+        movies = await run_parse_job(parse_listing_page, content, scraper_info)
 
         if movies:
             logger.info(f"✅ {len(movies)} initial movies extracted from {site_name}")
-            # Cache the results
-            _scrape_cache[site_url] = {'movies': movies, 'timestamp': datetime.now()}
         else:
             logger.warning(f"⚠️ No movies found on {site_name} (main page) with current selectors.")
-            update_site_status(site_name, 'failed', f"No movies found on main page.")
+            _record_site_status(site_statuses, site_name, 'failed', f"No movies found on main page.")
         return movies
     except aiohttp.ClientError as e:
         error_msg = f"HTTP/Client error fetching/parsing main page for {site_name} ({site_url}): {e}"
         logger.error(f"❌ {error_msg}")
-        update_site_status(site_name, 'failed', error_msg)
+        _record_site_status(site_statuses, site_name, 'failed', error_msg)
         return []
     except Exception as e:
         error_msg = f"Unexpected error fetching/parsing main page for {site_name} ({site_url}): {e}"
         logger.error(f"❌ {error_msg}")
-        update_site_status(site_name, 'failed', error_msg)
+        _record_site_status(site_statuses, site_name, 'failed', error_msg)
         return []
 
+async def process_listing_item(session: aiohttp.ClientSession, movie_initial_data: dict, unreachable_hosts: dict, round_writes: dict):
+    """
+    Visits the detail page of a single listing item and queues its database writes in round_writes
+    ({"movies": [...], "checked_urls": [...], "site_statuses": {...}}), which are saved in one go at the end of the round.
+    The detail GET doubles as URL validation; hosts that cannot be connected to are recorded
+    in unreachable_hosts ({host: error}) so the rest of their items are skipped this round.
+    """
+    source_name = movie_initial_data["source_name_for_logging"]
+    site_statuses = round_writes["site_statuses"]
+    host = urlparse(movie_initial_data["url"]).netloc
+    try:
+        cleaned_title_text = clean_title(movie_initial_data["title"])
+
+        details = await extract_detailed_movie_info_async(session, movie_initial_data["url"], cleaned_title_text)
+        if details is None: # Detail page unchanged since it was stored
+            round_writes["checked_urls"].append(movie_initial_data["url"])
+            _record_site_status(site_statuses, source_name, 'active')
+            return
+
+        # Use extracted data or fallback to initial data
+        movie_description = details["description"] if details["description"] else ""
+        movie_release_year = details["release_year"]
+        if not movie_release_year: # Fallback to year in title if not found on detail page
+            year_match = _YEAR_RE.search(movie_initial_data["title"])
+            if year_match:
+                movie_release_year = int(year_match.group(1))
+
+        # Use the category hint from the scraper definition or deduce from title/URL
+        category = deduce_category(cleaned_title_text, movie_initial_data["url"], movie_initial_data.get("category_hint"))
+
+        round_writes["movies"].append({
+            "title": cleaned_title_text,
+            "url": movie_initial_data["url"],
+            "source": source_name,
+            "image_url": movie_initial_data.get("image_url"),
+            "category": category,
+            "description": movie_description,
+            "release_year": movie_release_year,
+            "genres": details["genres"] # New: Add genres
+        })
+        _record_site_status(site_statuses, source_name, 'active')
+
+    except InvalidMovieURLError as e:
+        logger.warning(f"Skipping invalid URL: {e}")
+        _record_site_status(site_statuses, source_name, 'failed', f"Invalid URL: {e}")
+    except aiohttp.ClientConnectorError as e:
+        unreachable_hosts[host] = str(e)
+        logger.warning(f"Host {host} unreachable, skipping its remaining items this round: {e}")
+        _record_site_status(site_statuses, source_name, 'failed', f"Host unreachable: {e}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning(f"⚠️ Error fetching movie details from {movie_initial_data['url']}: {e!r}")
+        _record_site_status(site_statuses, source_name, 'failed', f"Error fetching {movie_initial_data['url']}: {e!r}")
+    except Exception as e:
+        logger.error(f"  ❌ Error processing movie from {source_name} ({movie_initial_data.get('title', 'N/A')}): {e}")
+        _record_site_status(site_statuses, source_name, 'failed', str(e))
+
+async def _produce_listing_items(session: aiohttp.ClientSession, scraper_info: dict, queue_for_host, site_statuses: dict):
+    """
+    Producer: scrapes the main page of a single site and feeds each item into the detail queue
+    of its host (queue_for_host(host) returns that queue, starting the host's workers on first use).
+    Never raises: an error only fails this site, so the other producers and the round's collected
+    writes are unaffected (items already queued are still processed).
+    """
+    try:
+        await _feed_listing_items(session, scraper_info, queue_for_host, site_statuses)
+    except Exception as e:
+        logger.error(f"❌ {scraper_info['name']}: listing items could not be queued: {e!r}")
+        _record_site_status(site_statuses, scraper_info["name"], 'failed', f"Error queueing listing items: {e!r}")
+
+async def _feed_listing_items(session: aiohttp.ClientSession, scraper_info: dict, queue_for_host, site_statuses: dict):
+    """Body of _produce_listing_items: fetches the site's listing and queues the items that need their detail page."""
+    movies_from_site = await scrape_single_main_page_and_parse(session, scraper_info, site_statuses)
+    # Site status already recorded in scrape_single_main_page_and_parse if failed
+    if not movies_from_site:
+        return
+
+    # Pre-pass: movies already stored with recently fetched details skip the detail page entirely
+    fresh_urls = await db_async.get_fresh_movie_urls([movie["url"] for movie in movies_from_site], config.DETAIL_REFRESH_DAYS)
+    if fresh_urls:
+        logger.info(f"⏭️ {scraper_info['name']}: skipping {len(fresh_urls)} of {len(movies_from_site)} already known movies.")
+        _record_site_status(site_statuses, scraper_info["name"], 'active')
+
+    for movie in movies_from_site:
+        if movie["url"] in fresh_urls:
+            continue
+        await queue_for_host(urlparse(movie["url"]).netloc).put({
+            **movie,
+            "source_name_for_logging": scraper_info["name"],
+            "category_hint": scraper_info.get("category_hint"),
+        })
+
+async def _detail_page_worker(session: aiohttp.ClientSession, host: str, queue: asyncio.Queue, fetch_slots: asyncio.Semaphore,
+                              unreachable_hosts: dict, round_writes: dict) -> int:
+    """
+    Consumer for one host: processes that host's listing items until it receives the None sentinel.
+    Every host gets its own queue and SCRAPE_PER_HOST_CONCURRENCY workers, so a busy site never
+    parks workers that could be fetching from other sites; fetch_slots caps the detail pages in
+    flight across all hosts at SCRAPE_MAX_CONCURRENCY.
+    Returns the number of items this worker processed.
+    """
+    processed_count = 0
+    while True:
+        movie_initial_data = await queue.get()
+        try:
+            if movie_initial_data is None:
+                return processed_count
+            processed_count += 1
+
+            if host in unreachable_hosts:
+                logger.debug(f"Skipping {movie_initial_data['url']}: host {host} unreachable this round.")
+                continue
+
+            async with fetch_slots:
+                await process_listing_item(session, movie_initial_data, unreachable_hosts, round_writes)
+            await asyncio.sleep(config.SCRAPE_PER_HOST_DELAY_SECONDS) # Polite delay per host, without holding a global slot
+        finally:
+            queue.task_done()
+
+def save_round_writes(round_writes: dict, round_started_at: datetime) -> list:
+    """
+    Saves everything a scraping round collected: all movies in one upsert transaction,
+    the detail-page checks in one update, and one status row per site.
+    Returns the newly added works: one movie per release first seen this round, with its
+    "sources" (see db_manager.group_movies_by_work).
+    """
+    new_urls = upsert_movies_batch(round_writes["movies"])
+    mark_details_fetched(round_writes["checked_urls"])
+    update_site_statuses(round_writes["site_statuses"])
+
+    newly_added_movies = []
+    for movie_data in round_writes["movies"]:
+        if movie_data["url"] in new_urls:
+            newly_added_movies.append(movie_data)
+            new_urls.discard(movie_data["url"]) # A URL listed twice in a round is only new once
+    return group_movies_by_work(newly_added_movies, new_since=round_started_at)
+
 async def scrape_movies_and_get_new() -> list:
     """
     Orchestrates scraping from all sites, fetches detailed info, and updates the database.
+    Main pages are producers and each host's items are consumed by that host's own workers, so
+    sites are fetched side by side and a round takes about as long as the slowest site instead
+    of the sum of all sites.
+    Database writes are collected during the round and saved in a few transactions at the end.
     Returns a list of newly added movies.
     """
-    newly_added_movies = [] 
-    total_processed_count = 0 
-    
-    async with aiohttp.ClientSession() as session:
-        # Step 1: Scrape main pages concurrently to get initial movie links and basic info
-        scrape_tasks = []
-        for scraper_info in SCRAPERS:
-            scrape_tasks.append(scrape_single_main_page_and_parse(session, scraper_info))
-        
-        all_initial_movies_results = await asyncio.gather(*scrape_tasks)
-
-        all_initial_movies_flat = []
-        for scraper_idx, movies_from_site in enumerate(all_initial_movies_results):
-            scraper_info = SCRAPERS[scraper_idx]
-            if movies_from_site:
-                for movie in movies_from_site:
-                    movie['source_name_for_logging'] = scraper_info['name']
-                    movie['category_hint'] = scraper_info.get('category_hint')
-                all_initial_movies_flat.extend(movie) # Extend with individual movie dicts
-            # Site status already updated in scrape_single_main_page_and_parse if failed
-
-        # Step 2: Process each initial movie, visit its detail page, and add/update in DB
-        # This part processes sequentially with a small delay for politeness.
-        for movie_initial_data in all_initial_movies_flat:
-            total_processed_count += 1
-            try:
-                # Validate URL before proceeding to detail page scraping
-                if not await validate_url_async(session, movie_initial_data["url"]):
-                    logger.warning(f"Skipping invalid or unreachable URL: {movie_initial_data['url']}")
-                    update_site_status(movie_initial_data["source_name_for_logging"], 'failed', f"Invalid URL: {movie_initial_data['url']}")
-                    continue
-
-                cleaned_title_text = clean_title(movie_initial_data["title"])
-
-                detailed_description, accurate_release_year, genres = await extract_detailed_movie_info_async(
-                    session, movie_initial_data["url"], cleaned_title_text
+    round_started_at = datetime.now()
+    round_writes = {"movies": [], "checked_urls": [], "site_statuses": {}}
+    unreachable_hosts = {}
+    host_queues = {} # host -> queue of its listing items
+    workers = []
+    fetch_slots = asyncio.Semaphore(config.SCRAPE_MAX_CONCURRENCY)
+
+    async with scraper_session() as session:
+        def queue_for_host(host: str) -> asyncio.Queue:
+            # Step 2 (consumers): a host's workers start with its first item and fetch detail pages as they arrive
+            if host not in host_queues:
+                host_queues[host] = asyncio.Queue(maxsize=config.SCRAPE_QUEUE_SIZE)
+                workers.extend(
+                    asyncio.create_task(_detail_page_worker(session, host, host_queues[host], fetch_slots, unreachable_hosts, round_writes))
+                    for _ in range(config.SCRAPE_PER_HOST_CONCURRENCY)
                 )
-                await asyncio.sleep(0.5) # Polite delay for detail pages
-
-                # Use extracted data or fallback to initial data
-                movie_description = detailed_description if detailed_description else ""
-                movie_release_year = accurate_release_year
-                if not movie_release_year: # Fallback to year in title if not found on detail page
-                    year_match = re.search(r'(\d{4})', movie_initial_data["title"])
-                    if year_match:
-                        try:
-                            movie_release_year = int(year_match.group(1))
-                        except ValueError:
-                            movie_release_year = None
-                
-                # Use the category hint from the scraper definition or deduce from title/URL
-                category = deduce_category(cleaned_title_text, movie_initial_data["url"], movie_initial_data.get("category_hint"))
-
-                movie_data_for_db = {
-                    "title": cleaned_title_text,
-                    "url": movie_initial_data["url"],
-                    "source": movie_initial_data["source_name_for_logging"],
-                    "image_url": movie_initial_data.get("image_url"),
-                    "category": category,
-                    "description": movie_description,
-                    "release_year": movie_release_year,
-                    "genres": genres # New: Add genres
-                }
-
-                is_new = upsert_movie(movie_data_for_db)
-                if is_new:
-                    newly_added_movies.append(movie_data_for_db)
-                
-                update_site_status(movie_initial_data["source_name_for_logging"], 'active', None)
-
-            except Exception as e:
-                logger.error(f"  ❌ Error processing movie from {movie_initial_data.get('source_name_for_logging', 'N/A')} ({movie_initial_data.get('title', 'N/A')}): {e}")
-                update_site_status(movie_initial_data["source_name_for_logging"], 'failed', str(e))
-
-    logger.info(f"✅ Processed {total_processed_count} movies in this round. {len(newly_added_movies)} are new.")
+            return host_queues[host]
+
+        # Step 1 (producers): scrape main pages concurrently to get initial movie links and basic info
+        try:
+            await asyncio.gather(*(_produce_listing_items(session, scraper_info, queue_for_host, round_writes["site_statuses"])
+                                   for scraper_info in SCRAPERS))
+        finally:
+            for host_queue in host_queues.values():
+                for _ in range(config.SCRAPE_PER_HOST_CONCURRENCY):
+                    await host_queue.put(None)
+            processed_counts = await asyncio.gather(*workers)
+
+    # Step 3: save the whole round (blocking SQLite work, kept off the event loop)
+    newly_added_movies = await asyncio.to_thread(save_round_writes, round_writes, round_started_at)
+
+    total_processed_count = sum(processed_counts)
+    site_statuses = round_writes["site_statuses"].values()
+    await db_async.record_scrape_round(
+        "scrapers", round_started_at, datetime.now(), total_processed_count, len(newly_added_movies),
+        sites_ok=sum(1 for status, _ in site_statuses if status == 'active'),
+        sites_failed=sum(1 for status, _ in site_statuses if status != 'active'),
+    )
+    logger.info(f"✅ Processed {total_processed_count} movies in this round. {len(newly_added_movies)} new titles.")
     return newly_added_movies
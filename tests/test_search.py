@@ -0,0 +1,35 @@
+import pytest
+import config
+import db_manager
+from utils import make_search_key
+
+@pytest.fixture
+def movies_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "movies.db"))
+    db_manager.init_db()
+    db_manager.upsert_movies_batch([
+        {"title": "فيلم الرحلة 2023", "url": "https://example.com/al-rihla", "source": "Wecima", "category": "فيلم",
+         "description": "قصة عائلة في طريق طويل", "release_year": 2023},
+        {"title": "Avengers Endgame", "url": "https://example.com/avengers", "source": "MyCima", "category": "فيلم",
+         "description": "", "release_year": 2019},
+    ])
+    yield
+    db_manager.close_connection()
+
+def _found_urls(rows) -> set:
+    return {row[1] for row in rows}
+
+def test_search_finds_word_with_attached_article(movies_db):
+    assert _found_urls(db_manager.get_movies_for_search("رحلة")) == {"https://example.com/al-rihla"}
+    rows, _ = db_manager.search_movies_page("رحلة")
+    assert _found_urls(rows) == {"https://example.com/al-rihla"}
+
+def test_search_finds_infix(movies_db):
+    assert _found_urls(db_manager.get_movies_for_search("venger")) == {"https://example.com/avengers"}
+
+def test_search_key_drops_attached_article():
+    assert make_search_key("الرحلة") == make_search_key("رحلة") == make_search_key("للرحلة")
+
+def test_title_prefix_search_ignores_article(movies_db):
+    db_manager.upsert_movies_batch([{"title": "الرحلة الأخيرة", "url": "https://example.com/last-trip", "source": "TopCinema"}])
+    assert db_manager.get_movies_for_search("رحلة الاخيرة")[0][1] == "https://example.com/last-trip"
@@ -1,23 +1,150 @@
 import re
-import aiohttp
 import logging
 from urllib.parse import urlparse
 
 logger = logging.getLogger(__name__)
 
+# --- Precompiled cleanup patterns (compiled once at import, reused for every title/description) ---
+_TITLE_NOISE_RE = re.compile(r'\s*\(\d{4}\)|\s*\[.*?\]|\s*مترجم|\s*اون لاين|\s*online|\s*HD|\s*WEB-DL|\s*BluRay|\s*نسخة مدبلجة|\s*كامل|\s*جودة عالية|\s*كاملة|\s*مباشر|\s*مشاهدة|\s*تحميل|\s*سيرفرات|\s*سيرفر|\s*فيلم|\s*مسلسل|\s*انمي', re.IGNORECASE)
+_SYMBOLS_RE = re.compile(r'[^\w\s\u0600-\u06FF]+')
+_LEADING_SYMBOLS_RE = re.compile(r'^[^\w\s\u0600-\u06FF]+')
+_TRAILING_SYMBOLS_RE = re.compile(r'[^\w\s\u0600-\u06FF]+$')
+_MULTI_SPACE_RE = re.compile(r'\s{2,}')
+
+# --- Arabic normalization for search keys ---
+# Letter variants the sites spell inconsistently are folded to one form; diacritics (harakat) and tatweel are dropped.
+# db_manager mirrors this mapping in SQL for the full-text index, so both sides normalize identically.
+ARABIC_NORMALIZATION_MAP = {
+    "\u0623": "\u0627", "\u0625": "\u0627", "\u0622": "\u0627", "\u0671": "\u0627", # أ إ آ ٱ -> ا
+    "\u0629": "\u0647", # ة -> ه
+    "\u0649": "\u064a", # ى -> ي
+    **{mark: "" for mark in "\u064b\u064c\u064d\u064e\u064f\u0650\u0651\u0652\u0670\u0640"}, # harakat, superscript alef, tatweel
+}
+_ARABIC_NORMALIZATION_TABLE = str.maketrans(ARABIC_NORMALIZATION_MAP)
+_NON_WORD_RE = re.compile(r'[\W_]+')
+_ARABIC_ARTICLE_RE = re.compile(r'^(?:[\u0648\u0628\u0641\u0643]?\u0627\u0644|\u0644\u0644)(?=\w{2})') # ال / وال بال فال كال / لل, leaving 2+ letters
+_YEAR_TOKEN_RE = re.compile(r'\b(?:19|20)\d{2}\b')
+
+# Promotional phrases stripped from scraped descriptions, applied one after another in this order.
+PROMO_PHRASES = [
+    r'مشاهدة وتحميل (فيلم|مسلسل|انمي)?\s*', r'مشاهدة (فيلم|مسلسل|انمي)?\s*',
+    r'تحميل مباشر\s*', r'تنزيل مباشر\s*', r'حصريا\s*', r'فقط\s*',
+    r'اون لاين\s*', r'مباشرة\s*', r'روابط سريعة\s*',
+    r'بجودة\s*(?:HD|FHD|4K|720p|1080p|BluRay|WEB-DL|HDRip|DVDRip|BDRip|WEBRip)?\s*',
+    r'كامل ومترجم\s*', r'مترجم للعربية\s*', r'مدبلج\s*',
+    r'بدون إعلانات\s*', r'شاهد مجانا\s*', r'مجاناً\s*',
+    r'جميع حلقات\s*', r'الموسم (?:الاول|الثاني|الثالث|الرابع|الخامس|السادس|السابع|الثامن|التاسع|العاشر|الأول|الثاني|الثالث|الرابع|الخامس|السادس|السابع|الثامن|التاسع|العاشر|\d+)\s*',
+    r'ايجي بست\s*', r'وي سيما\s*', r'ماي سيما\s*', r'سيما كلوب\s*',
+    r'تكتوك سيما\s*', r'اكوام\s*', r'شاهد فور يو\s*', r'افلامكو\s*',
+    r'سيما فور يو\s*', r'فوشار\s*', r'افلام\s*', r'موقع [أ-ي\w\s]*?\s*',
+    r'قصة (فيلم|مسلسل|انمي)\s*(?:جديد)?\s*(?:تدور احداث)?\s*(?:حول)?\s*',
+    r'تدور احداث (الفيلم|المسلسل|الانمي)?\s*(?:حول)?\s*',
+    r'احداث (الفيلم|المسلسل|الانمي)?\s*(?:حول)?\s*',
+    r'ملخص القصة\s*(?:حول)?\s*',
+    r'تبدأ الاحداث عندما\s*',
+    r'فيلم (جديد|حصري|الأن)?\s*', r'مسلسل (جديد|حصري|الأن)?\s*', r'انمي (جديد|حصري|الأن)?\s*',
+    r'أفلام202[0-9]|مسلسلات202[0-9]|أنمي202[0-9]',
+    r'اونلاين'
+]
+
+def _required_literals(pattern: str) -> tuple:
+    """
+    Returns the literal prefixes of a phrase pattern (one per top-level alternative).
+    A pattern can only match text that contains one of them.
+    """
+    alternatives, depth, start = [], 0, 0
+    for i, char in enumerate(pattern):
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            alternatives.append(pattern[start:i])
+            start = i + 1
+    alternatives.append(pattern[start:])
+
+    literals = []
+    for alternative in alternatives:
+        literal = re.match(r'[^\\()\[\]?*+|{}.^$]*', alternative).group(0)
+        if alternative[len(literal):len(literal) + 1] in ('?', '*', '{'):
+            literal = literal[:-1] # The last character is optional
+        literals.append(literal)
+    return tuple(literals)
+
+# Compiled rule engine: every phrase is compiled once and guarded by its literal prefix, so a
+# description only pays a regex scan for the few phrases it actually contains (a plain substring
+# check rejects the rest). Rules still run in order, so the output is identical to applying
+# PROMO_PHRASES one by one. All prefixes are Arabic, which has no case, so IGNORECASE does not
+# affect the guards.
+_PROMO_RULES = [
+    (_required_literals(phrase), re.compile(phrase, re.IGNORECASE | re.DOTALL))
+    for phrase in PROMO_PHRASES
+]
+
 def clean_title(title: str) -> str:
     """
     Cleans movie titles by removing common extraneous information and special characters.
     Handles Arabic and English characters.
     """
     # Remove years in parentheses, brackets, and common promotional/quality phrases
-    title = re.sub(r'\s*\(\d{4}\)|\s*\[.*?\]|\s*مترجم|\s*اون لاين|\s*online|\s*HD|\s*WEB-DL|\s*BluRay|\s*نسخة مدبلجة|\s*كامل|\s*جودة عالية|\s*كاملة|\s*مباشر|\s*مشاهدة|\s*تحميل|\s*سيرفرات|\s*سيرفر|\s*فيلم|\s*مسلسل|\s*انمي', '', title, flags=re.IGNORECASE)
+    title = _TITLE_NOISE_RE.sub('', title)
     # Remove any non-alphanumeric, non-space, non-Arabic characters
-    title = re.sub(r'[^\w\s\u0600-\u06FF]+', '', title)
+    title = _SYMBOLS_RE.sub('', title)
     # Replace multiple spaces with a single space
-    title = re.sub(r'\s{2,}', ' ', title)
+    title = _MULTI_SPACE_RE.sub(' ', title)
     return title.strip()
 
+def clean_description(description: str, movie_title_for_ref: str = "") -> str:
+    """
+    Cleans a scraped description from promotional phrases, surrounding symbols and
+    a repeated movie title, and truncates it to 500 characters.
+    """
+    # The original loop stripped after every phrase, matched or not; stripping once up front keeps
+    # the guarded rules equivalent (a skipped rule would only have stripped already-stripped text)
+    description = description.strip()
+    for literals, phrase_re in _PROMO_RULES:
+        if any(literal in description for literal in literals):
+            description = phrase_re.sub('', description).strip()
+
+    description = _LEADING_SYMBOLS_RE.sub('', description).strip()
+    description = _TRAILING_SYMBOLS_RE.sub('', description).strip()
+
+    if movie_title_for_ref and description.lower().startswith(movie_title_for_ref.lower()):
+        description = description[len(movie_title_for_ref):].strip()
+        description = _LEADING_SYMBOLS_RE.sub('', description).strip()
+
+    description = _MULTI_SPACE_RE.sub(' ', description).strip()
+
+    if len(description) > 500:
+        description = description[:497] + "..."
+    return description
+
+def normalize_arabic(text: str) -> str:
+    """Folds Arabic letter variants (أ/إ/آ -> ا, ة -> ه, ى -> ي) and removes diacritics and tatweel."""
+    return text.translate(_ARABIC_NORMALIZATION_TABLE)
+
+def _fold_text(text: str) -> str:
+    """Arabic-normalizes and case-folds text, replacing punctuation by single spaces."""
+    return _NON_WORD_RE.sub(" ", normalize_arabic(text).casefold()).strip()
+
+def make_search_key(text: str) -> str:
+    """
+    Builds the normalized search key of a title or query: Arabic-normalized, case-folded,
+    punctuation replaced by single spaces and the attached article (ال, وال, بال, فال, كال, لل)
+    removed from every word. Equal keys mean the same title spelled differently ("الرحلة" / "رحلة").
+    """
+    if not text:
+        return ""
+    return " ".join(_ARABIC_ARTICLE_RE.sub("", word) for word in _fold_text(text).split())
+
+def make_work_block_key(title: str, category: str) -> str:
+    """
+    Blocking key for cross-source duplicate detection: the category plus the title's search key
+    without year tokens (the year is compared separately). Only movies sharing this key are compared.
+    """
+    title_core = _MULTI_SPACE_RE.sub(" ", _YEAR_TOKEN_RE.sub(" ", _fold_text(title))).strip()
+    return f"{category or ''}|{title_core}"
+
 def deduce_category(title: str, url: str, category_hint: str = None) -> str:
     """
     Deduces the category (فيلم, مسلسل, أنمي) based on title, URL, and an optional hint.
@@ -37,22 +164,14 @@ def deduce_category(title: str, url: str, category_hint: str = None) -> str:
     # Default to movie
     return "فيلم"
 
-async def validate_url_async(session: aiohttp.ClientSession, url: str) -> bool:
-    """
-    Asynchronously checks if a URL is valid and returns a 200 OK status.
-    """
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
-        }
-        async with session.head(url, headers=headers, timeout=10) as response:
-            return response.status == 200
-    except aiohttp.ClientError as e:
-        logger.warning(f"URL validation failed for {url}: {e}")
-        return False
-    except Exception as e:
-        logger.warning(f"Unexpected error during URL validation for {url}: {e}")
-        return False
+def is_redirected_to_site_root(requested_url: str, final_url: str) -> bool:
+    """
+    Checks if a request for a specific page ended up on the site's home page,
+    which is how most of these sites answer for removed or invalid items.
+    """
+    requested_path = urlparse(requested_url).path.strip("/")
+    final_path = urlparse(final_url).path.strip("/")
+    return bool(requested_path) and not final_path
 
 def get_base_url(full_url: str) -> str:
     """Extracts the base URL (scheme + netloc) from a full URL."""